@@ -0,0 +1,427 @@
+#!/usr/bin/env python
+#
+# benchmarks for the packet to output pipeline
+#
+# runs source/code.py on the simulation stand-ins and reports, as JSON:
+#
+#   match     Beacon.match throughput (frames/s) for 1 to 100 beacons
+#   latency   time from a frame entering wifi.Monitor to Output.activate
+#   heap      peak and retained heap allocation per sniffed frame
+#   presence  that only frames a beacon transmits measure its signal level
+#   web       frames lost or missed while the web server serves assets
+#
+# heap numbers come from tracemalloc under CPython, so they compare commits
+# rather than predict the device heap
+#
+#   python simulation/benchmark.py --lib .cache --output bench.json
+#   python simulation/benchmark.py --lib .cache --capture home.pcap match heap
+#
+
+import argparse
+import asyncio
+import contextlib
+import copy
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+import urllib.request
+
+import capture
+import simulate
+
+BEACONS = (1, 2, 5, 10, 20, 50, 100)
+
+def beacon_address (index):
+    return f'02:bb:00:00:{(index >> 8) & 0xff:02x}:{index & 0xff:02x}'
+
+def configuration (beacons=1, timeout=1, sniffer=None):
+    #
+    # the simulation configuration with the given number of beacons, all
+    # mapped to every output, and a short output timeout
+    #
+    with open (os.path.join (simulate.HERE, 'config.json')) as file:
+        base = json.load (file)
+
+    result = copy.deepcopy (base)
+    result['beacon'] = {}
+    for index in range (beacons):
+        result['beacon'][beacon_address (index)] = {'enabled': True, 'name': f'beacon {index}'}
+
+    for location in result['mapping']:
+        outputs = sorted (result['output'])
+        result['mapping'][location] = {f'beacon {index}': outputs for index in range (beacons)}
+
+    for output in result['output'].values ():
+        output['timeout'] = timeout
+
+    if sniffer is not None:
+        result['sniffer'] = sniffer
+
+    return result
+
+def frames_for (arguments, beacons):
+    if arguments.capture:
+        return capture.read (arguments.capture)
+
+    #
+    # keep the beacon traffic at a fixed share of the whole
+    #
+    return capture.synthesize ([beacon_address (index) for index in range (beacons)], duration=arguments.seconds, rate=2000, share=0.05 / beacons)
+
+def quiet ():
+    return contextlib.redirect_stdout (open (os.devnull, 'w'))
+
+def loaded (beacons):
+    #
+    # a fresh copy of code.py with beacons and outputs created, but no tasks
+    #
+    module = simulate.load ()
+    config = configuration (beacons)
+
+    for id, parameters in config['beacon'].items ():
+        module.Beacon.factory (id, parameters)
+
+    module.Sniffer.configure (config.get ('sniffer', {}))
+
+    return module
+
+def bench_match (arguments):
+    results = []
+
+    for beacons in BEACONS:
+        with quiet ():
+            module = loaded (beacons)
+
+        raws = [(raw, -60 if rssi is None else rssi, channel) for _, channel, rssi, raw in frames_for (arguments, beacons)]
+        accept = module.Frame.accept
+        match = module.Beacon.match
+
+        with quiet ():
+            matched = 0
+            start = time.perf_counter ()
+            for raw, rssi, channel in raws:
+                if accept (raw) and match (raw, rssi, channel) is not None:
+                    matched += 1
+            elapsed = time.perf_counter () - start
+
+        results.append ({
+            'beacons': beacons,
+            'frames': len (raws),
+            'matched': matched,
+            'seconds': elapsed,
+            'frames_per_second': len (raws) / elapsed if elapsed else None
+        })
+
+    return results
+
+def bench_heap (arguments):
+    import wifi
+
+    results = []
+
+    for beacons in (1, 100):
+        with quiet ():
+            module = loaded (beacons)
+
+        frames = frames_for (arguments, beacons)
+        monitor = wifi.Monitor (channel=6, queue=len (frames))
+        for _, channel, rssi, raw in frames:
+            monitor.receive (None, rssi, raw)
+
+        count = len (frames)
+        module.Sniffer.batch = count
+        module.Sniffer.budget = 1 << 28
+
+        with quiet ():
+            tracemalloc.start ()
+            before = tracemalloc.get_traced_memory ()[0]
+            tracemalloc.reset_peak ()
+            module.Sniffer.drain (monitor)
+            after, peak = tracemalloc.get_traced_memory ()
+            tracemalloc.stop ()
+
+        monitor.deinit ()
+
+        results.append ({
+            'beacons': beacons,
+            'frames': count,
+            'peak_bytes': peak - before,
+            'peak_bytes_per_frame': (peak - before) / count,
+            'retained_bytes_per_frame': (after - before) / count
+        })
+
+    return results
+
+def bench_presence (arguments):
+    #
+    # a frame that names a beacon as the receiver carries the signal of the
+    # access point, which must not make a distant beacon arrive
+    #
+    with quiet ():
+        module = loaded (1)
+
+    beacon = next (iter (module.Beacon.inventory.values ()))
+    ap = capture.address ('02:00:00:00:00:01')
+    phone = capture.address (beacon_address (0))
+
+    received = capture.frame (0x88, 0x02, (phone, ap, ap), b'\x00' * 32)
+    sent = capture.frame (0x88, 0x01, (ap, phone, ap), b'\x00' * 32)
+
+    def arrived (raw, rssi, count=5):
+        for _ in range (count):
+            if module.Frame.accept (raw):
+                module.Beacon.match (raw, rssi, 6)
+
+        with quiet ():
+            module.Beacon.assess_all ()
+
+        return beacon in module.Beacon.present
+
+    results = {
+        'enter': beacon.enter,
+        'receiver_only': arrived (received, -35),
+        'weak_transmitter': arrived (sent, -85),
+        'transmitter': arrived (sent, -50)
+    }
+
+    results['passed'] = not results['receiver_only'] and not results['weak_transmitter'] and results['transmitter']
+
+    return results
+
+async def settle (module, timeout=30):
+    #
+    # wait until the device is connected and routing for its location
+    #
+    deadline = time.monotonic () + timeout
+    while module.Beacon.location is None:
+        if time.monotonic () > deadline:
+            raise RuntimeError ('simulation did not connect')
+        await asyncio.sleep (0.05)
+
+def bench_latency (arguments):
+    import wifi
+
+    simulation = simulate.Simulation (configuration (1), port=arguments.port, libs=arguments.lib)
+    module = simulation.module
+
+    #
+    # record when each output is activated
+    #
+    activations = []
+    original = module.Output.activate
+
+    async def activate (self):
+        activations.append ((time.perf_counter (), self.name, self.state))
+        await original (self)
+
+    module.Output.activate = activate
+
+    raw = capture.frame (0x88, 0x01, (b'\x02\x00\x00\x00\x00\x01', capture.address (beacon_address (0)), b'\x02\x00\x00\x00\x00\x01'), b'\x00' * 32)
+    results = []
+
+    async def trials (task):
+        await settle (module)
+
+        for trial in range (arguments.trials):
+            #
+            # wait for every output to time out and switch off
+            #
+            while any (output.state or output.pending for output in module.Output.inventory.values ()):
+                await asyncio.sleep (0.01)
+
+            await asyncio.sleep (0.2)
+
+            del activations[:]
+            start = time.perf_counter ()
+            wifi.Monitor.inject (raw)
+
+            while len ([entry for entry in activations if entry[2]]) < len (module.Output.inventory):
+                if time.perf_counter () - start > 10:
+                    break
+                await asyncio.sleep (0)
+
+            results.append ({entry[1]: entry[0] - start for entry in activations if entry[2]})
+
+        task.cancel ()
+
+    async def run ():
+        task = asyncio.create_task (simulation.run ())
+        await trials (task)
+        with contextlib.suppress (asyncio.CancelledError):
+            await task
+
+    try:
+        with quiet ():
+            asyncio.run (run ())
+    finally:
+        simulation.close ()
+
+    summary = {}
+    for name in sorted (module.Output.inventory):
+        samples = sorted (result[name] for result in results if name in result)
+        if samples:
+            summary[name] = {
+                'samples': len (samples),
+                'median_ms': samples[len (samples) // 2] * 1000,
+                'max_ms': samples[-1] * 1000
+            }
+
+    return summary
+
+def bench_web (arguments):
+    #
+    # compare each way the sniffer can share time with the web server
+    #
+    results = {}
+    for index, mode in enumerate (('concurrent', 'pause', 'restart')):
+        results[mode] = web_windows (arguments, mode, arguments.port + 1 + index)
+
+    return results
+
+def web_windows (arguments, mode, port):
+    import wifi
+
+    frames = frames_for (arguments, 1)
+    simulation = simulate.Simulation (configuration (1, sniffer={'http': mode}), frames, loop=True, port=port, libs=arguments.lib, bundle=arguments.bundle)
+    module = simulation.module
+
+    assets = ['/', '/styles.css', '/main.js', '/incognito.svg', '/file-earmark-plus.svg', '/file-earmark-check.svg', '/trash3.svg']
+    fetched = []
+
+    def client (stop):
+        while not stop.is_set ():
+            for asset in assets:
+                try:
+                    request = urllib.request.Request (f'http://127.0.0.1:{port}{asset}', headers={'accept-encoding': 'gzip'})
+                    with urllib.request.urlopen (request, timeout=10) as response:
+                        fetched.append (len (response.read ()))
+                except OSError:
+                    pass
+
+    def counters ():
+        wifi.Monitor.update ()
+
+        return {
+            'frames': module.Sniffer.frames,
+            'lost': module.Sniffer.lost,
+            'missed': wifi.Monitor.missed,
+            'offered': wifi.Monitor.offered
+        }
+
+    def delta (a, b):
+        return {key: b[key] - a[key] for key in a}
+
+    windows = {}
+
+    async def scenario (task):
+        await settle (module)
+        await asyncio.sleep (1)
+
+        #
+        # a quiet window, then one with the page being reloaded continuously
+        #
+        start = counters ()
+        await asyncio.sleep (arguments.window)
+        windows['idle'] = delta (start, counters ())
+
+        stop = threading.Event ()
+        thread = threading.Thread (target=client, args=(stop,), daemon=True)
+
+        start = counters ()
+        thread.start ()
+        await asyncio.sleep (arguments.window)
+        stop.set ()
+        windows['serving'] = delta (start, counters ())
+        windows['serving']['responses'] = len (fetched)
+        windows['serving']['bytes'] = sum (fetched)
+
+        await asyncio.get_running_loop ().run_in_executor (None, thread.join)
+        windows['spent'] = dict (module.Sniffer.spent)
+        task.cancel ()
+
+    async def run ():
+        task = asyncio.create_task (simulation.run ())
+        await scenario (task)
+        with contextlib.suppress (asyncio.CancelledError):
+            await task
+
+    try:
+        with quiet ():
+            asyncio.run (run ())
+    finally:
+        simulation.close ()
+
+    for name in ('idle', 'serving'):
+        window = windows[name]
+        offered = window['offered']
+        window['dropped'] = window['lost'] + window['missed']
+        window['dropped_fraction'] = window['dropped'] / offered if offered else None
+
+    return windows
+
+BENCHMARKS = {
+    'match': bench_match,
+    'heap': bench_heap,
+    'presence': bench_presence,
+    'latency': bench_latency,
+    'web': bench_web
+}
+
+def revision ():
+    try:
+        return subprocess.check_output (['git', 'describe', '--always', '--dirty'], cwd=simulate.HERE, stderr=subprocess.DEVNULL).decode ().strip ()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main ():
+    parser = argparse.ArgumentParser (description='benchmark the packet to output pipeline')
+    parser.add_argument ('benchmarks', nargs='*', metavar='benchmark', help=f'benchmarks to run, all by default: {", ".join (BENCHMARKS)}')
+    parser.add_argument ('--capture', help='pcap file to use instead of synthesized traffic')
+    parser.add_argument ('--seconds', type=float, default=10.0, help='seconds of traffic to synthesize')
+    parser.add_argument ('--trials', type=int, default=10, help='latency trials')
+    parser.add_argument ('--window', type=float, default=5.0, help='seconds per web measurement window')
+    parser.add_argument ('--port', type=int, default=18080, help='first local port for the web server')
+    parser.add_argument ('--lib', action='append', default=[], help='directory with additional libraries (biplane)')
+    parser.add_argument ('--bundle', action='store_true', help='serve minified and compressed assets like the Makefile stages them')
+    parser.add_argument ('--output', help='file to write the results to, stdout by default')
+    arguments = parser.parse_args ()
+
+    for name in arguments.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error (f'unknown benchmark {name}, choose from {", ".join (BENCHMARKS)}')
+
+    simulate.install (arguments.lib)
+
+    report = {
+        'revision': revision (),
+        'python': platform.python_version (),
+        'implementation': platform.python_implementation (),
+        'timestamp': int (time.time ()),
+        'results': {}
+    }
+
+    for name in arguments.benchmarks or BENCHMARKS:
+        report['results'][name] = BENCHMARKS[name] (arguments)
+
+    text = json.dumps (report, indent=4)
+
+    if arguments.output:
+        with open (arguments.output, 'w') as file:
+            file.write (text + '\n')
+    else:
+        print (text)
+
+    #
+    # fail on a regression check that did not pass
+    #
+    for name, result in report['results'].items ():
+        if isinstance (result, dict) and result.get ('passed') is False:
+            sys.exit (f'{name} check failed')
+
+if __name__ == '__main__':
+    main ()
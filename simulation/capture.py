@@ -0,0 +1,193 @@
+#
+# read, write and synthesize 802.11 captures for the simulation
+#
+# frames are (timestamp, channel, rssi, raw) tuples, where raw is the 802.11
+# frame as delivered by wifi.Monitor.packet () and channel or rssi are None
+# when the capture does not carry them
+#
+
+import random
+import struct
+
+LINKTYPE_IEEE802_11 = 105
+LINKTYPE_RADIOTAP = 127
+
+#
+# radiotap fields up to the antenna signal as (alignment, size) by bit
+#
+RADIOTAP = (
+    (8, 8),
+    (1, 1),
+    (1, 1),
+    (2, 4),
+    (2, 2),
+    (1, 1)
+)
+
+def frequency_to_channel (frequency):
+    if frequency == 2484:
+        return 14
+
+    if 2412 <= frequency <= 2472:
+        return (frequency - 2407) // 5
+
+    if 5000 <= frequency <= 5900:
+        return (frequency - 5000) // 5
+
+    return None
+
+def channel_to_frequency (channel):
+    if channel == 14:
+        return 2484
+
+    if channel <= 13:
+        return 2407 + 5 * channel
+
+    return 5000 + 5 * channel
+
+def radiotap (data):
+    #
+    # split a radiotap header from the frame, returning channel, rssi and
+    # the raw frame without any trailing FCS
+    #
+    length = struct.unpack_from ('<H', data, 2)[0]
+
+    presence = []
+    offset = 4
+    while True:
+        word = struct.unpack_from ('<I', data, offset)[0]
+        presence.append (word)
+        offset += 4
+        if not word & 0x80000000:
+            break
+
+    channel = None
+    rssi = None
+    fcs = False
+
+    present = presence[0]
+    for bit, (alignment, size) in enumerate (RADIOTAP):
+        if not present & (1 << bit):
+            continue
+
+        offset = (offset + alignment - 1) & ~(alignment - 1)
+
+        if bit == 1:
+            fcs = (data[offset] & 0x10) != 0
+        elif bit == 3:
+            channel = frequency_to_channel (struct.unpack_from ('<H', data, offset)[0])
+        elif bit == 5:
+            rssi = struct.unpack_from ('<b', data, offset)[0]
+
+        offset += size
+
+    raw = data[length:]
+    if fcs:
+        raw = raw[:-4]
+
+    return channel, rssi, raw
+
+def read (path):
+    frames = []
+
+    with open (path, 'rb') as file:
+        header = file.read (24)
+
+        magic = header[:4]
+        if magic in (b'\xd4\xc3\xb2\xa1', b'\x4d\x3c\xb2\xa1'):
+            order = '<'
+        elif magic in (b'\xa1\xb2\xc3\xd4', b'\xa1\xb2\x3c\x4d'):
+            order = '>'
+        else:
+            raise ValueError (f'{path} is not a pcap file')
+
+        scale = 1e-9 if magic in (b'\x4d\x3c\xb2\xa1', b'\xa1\xb2\x3c\x4d') else 1e-6
+        linktype = struct.unpack (order + 'I', header[20:24])[0]
+
+        if linktype not in (LINKTYPE_IEEE802_11, LINKTYPE_RADIOTAP):
+            raise ValueError (f'{path} has unsupported link type {linktype}')
+
+        while True:
+            record = file.read (16)
+            if len (record) < 16:
+                break
+
+            seconds, fraction, included, original = struct.unpack (order + 'IIII', record)
+            data = file.read (included)
+            timestamp = seconds + fraction * scale
+
+            if linktype == LINKTYPE_RADIOTAP:
+                channel, rssi, raw = radiotap (data)
+            else:
+                channel, rssi, raw = None, None, data
+
+            if len (raw) >= 10:
+                frames.append ((timestamp, channel, rssi, bytes (raw)))
+
+    return frames
+
+def write (path, frames):
+    with open (path, 'wb') as file:
+        file.write (struct.pack ('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, LINKTYPE_RADIOTAP))
+
+        for timestamp, channel, rssi, raw in frames:
+            #
+            # radiotap with flags, channel and antenna signal
+            #
+            header = struct.pack ('<BBHI', 0, 0, 15, 0x0000002a)
+            header += struct.pack ('<BxHHb', 0, channel_to_frequency (channel or 1), 0x00a0, rssi if rssi is not None else -100)
+
+            data = header + raw
+            seconds = int (timestamp)
+            micros = int (round ((timestamp - seconds) * 1e6))
+            file.write (struct.pack ('<IIII', seconds, micros, len (data), len (data)))
+            file.write (data)
+
+def address (text):
+    return bytes.fromhex (text.replace (':', '').replace ('-', ''))
+
+def frame (kind, flags, addresses, payload=b''):
+    return bytes ((kind, flags)) + b'\x00\x00' + b''.join (addresses) + (b'\x00\x00' if len (addresses) >= 3 else b'') + payload
+
+def synthesize (beacons, duration=60.0, rate=500, channel=6, seed=1, bssid='02:00:00:00:00:01', share=0.02, rssi=-55, start=1700000000.0):
+    #
+    # background traffic from an access point and unknown stations mixed
+    # with frames from the given beacon addresses, which each make up the
+    # given share of the traffic
+    #
+    generator = random.Random (seed)
+    ap = address (bssid)
+    broadcast = b'\xff' * 6
+    tracked = [address (beacon) for beacon in beacons]
+    stations = [bytes ((0x02, 0x10)) + generator.randbytes (4) for _ in range (20)]
+
+    frames = []
+    timestamp = start
+    end = start + duration
+
+    while timestamp < end:
+        timestamp += generator.expovariate (rate)
+        choice = generator.random ()
+
+        if tracked and choice < share * len (tracked):
+            station = tracked[int (choice / share)]
+            kind = generator.choice ((0x88, 0x48, 0x40, 0xc8))
+            if kind == 0x40:
+                raw = frame (kind, 0x00, (broadcast, station, broadcast), b'\x00\x00')
+            else:
+                raw = frame (kind, 0x01, (ap, station, ap), b'\x00' * 32)
+            level = rssi + generator.randint (-6, 6)
+        elif choice < 0.25:
+            raw = frame (0x80, 0x00, (broadcast, ap, ap), b'\x00' * 48)
+            level = -40 + generator.randint (-3, 3)
+        elif choice < 0.55:
+            raw = frame (0xd4, 0x00, (generator.choice (stations),))
+            level = -70 + generator.randint (-10, 10)
+        else:
+            station = generator.choice (stations)
+            raw = frame (0x88, 0x02, (station, ap, ap), b'\x00' * 64)
+            level = -70 + generator.randint (-10, 10)
+
+        frames.append ((timestamp, channel, level, raw))
+
+    return frames
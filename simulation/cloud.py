@@ -0,0 +1,142 @@
+#
+# local stand-in for the Tuya cloud API
+#
+# serves access tokens and device commands over plain HTTP on a background
+# thread, checks request signatures when the client secret is known and
+# records every request for inspection
+#
+
+import hashlib
+import hmac
+import http.server
+import json
+import threading
+import time
+
+class Handler (http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message (self, format, *args):
+        pass
+
+    def reply (self, data):
+        body = json.dumps (data).encode ('utf-8')
+        self.send_response (200)
+        self.send_header ('content-type', 'application/json')
+        self.send_header ('content-length', str (len (body)))
+        self.end_headers ()
+        self.wfile.write (body)
+
+    def failure (self, code, message):
+        self.reply ({'success': False, 'code': code, 'msg': message, 't': int (time.time () * 1000)})
+
+    def signed (self, body):
+        cloud = self.server.cloud
+
+        client_id = self.headers.get ('client_id', '')
+        secret = cloud.secrets.get (client_id)
+        if secret is None:
+            return 'sign' in self.headers
+
+        token = self.headers.get ('access_token', '')
+        digest = hashlib.sha256 (body).hexdigest ()
+        text = f'{client_id}{token}{self.headers.get ("t", "")}{self.command}\n{digest}\n\n{self.path}'
+        sign = hmac.new (secret.encode (), text.encode (), hashlib.sha256).hexdigest ().upper ()
+
+        return hmac.compare_digest (sign, self.headers.get ('sign', ''))
+
+    def handle_request (self):
+        cloud = self.server.cloud
+
+        length = int (self.headers.get ('content-length', '0'))
+        body = self.rfile.read (length) if length else b''
+
+        if cloud.latency:
+            time.sleep (cloud.latency)
+
+        with cloud.mutex:
+            cloud.requests.append ((time.monotonic (), self.command, self.path))
+
+        if not self.signed (body):
+            self.failure (1004, 'sign invalid')
+            return
+
+        if self.command == 'GET' and self.path.startswith ('/v1.0/token'):
+            token = f'token-{len (cloud.tokens) + 1}'
+            cloud.tokens.append (token)
+            self.reply ({
+                'success': True,
+                'result': {
+                    'access_token': token,
+                    'refresh_token': f'refresh-{token}',
+                    'expire_time': cloud.expire_time,
+                    'uid': 'simulation'
+                },
+                't': int (time.time () * 1000)
+            })
+            return
+
+        if self.headers.get ('access_token') not in cloud.tokens:
+            self.failure (1010, 'token invalid')
+            return
+
+        if self.command == 'POST' and self.path.startswith ('/v1.0/iot-03/devices/') and self.path.endswith ('/commands'):
+            device_id = self.path.split ('/')[4]
+            commands = json.loads (body)['commands']
+
+            with cloud.mutex:
+                cloud.commands.append ((time.monotonic (), device_id, commands))
+                for command in commands:
+                    cloud.devices.setdefault (device_id, {})[command['code']] = command['value']
+
+            for listener in cloud.listeners:
+                listener (device_id, commands)
+
+            self.reply ({'success': True, 'result': True, 't': int (time.time () * 1000)})
+            return
+
+        self.failure (1108, 'uri path invalid')
+
+    def do_GET (self):
+        self.handle_request ()
+
+    def do_POST (self):
+        self.handle_request ()
+
+class Cloud (object):
+    def __init__ (self, port=0, secrets=None, expire_time=7200, latency=0.0):
+        self.secrets = secrets or {}
+        self.expire_time = expire_time
+        self.latency = latency
+
+        self.mutex = threading.Lock ()
+        self.requests = []
+        self.commands = []
+        self.tokens = []
+        self.devices = {}
+        self.listeners = []
+
+        self.server = http.server.ThreadingHTTPServer (('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+        self.server.cloud = self
+
+        self.thread = threading.Thread (target=self.server.serve_forever, daemon=True)
+        self.thread.start ()
+
+    @property
+    def origin (self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @classmethod
+    def from_configuration (cls, configuration, **kwargs):
+        secrets = {}
+        for output in configuration.get ('output', {}).values ():
+            if output.get ('type') == 'tuya':
+                secrets[output['client_id']] = output['client_secret']
+
+        return cls (secrets=secrets, **kwargs)
+
+    def close (self):
+        self.server.shutdown ()
+        self.server.server_close ()
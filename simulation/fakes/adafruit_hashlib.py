@@ -0,0 +1,5 @@
+#
+# host stand-in for the adafruit_hashlib library
+#
+
+from hashlib import md5, sha1, sha224, sha256, sha384, sha512, new
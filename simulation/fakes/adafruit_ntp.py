@@ -0,0 +1,16 @@
+#
+# host stand-in for the adafruit_ntp library, reporting the host clock
+#
+
+import time
+
+class NTP (object):
+    queries = 0
+
+    def __init__ (self, socketpool, *, server='0.adafruit.pool.ntp.org', port=123, tz_offset=0, socket_timeout=10, cache_seconds=0):
+        self.tz_offset = tz_offset
+
+    @property
+    def datetime (self):
+        NTP.queries += 1
+        return time.gmtime (time.time () + self.tz_offset * 60 * 60)
@@ -0,0 +1,85 @@
+#
+# host stand-in for the adafruit_requests library
+#
+# every request is sent over plain HTTP to the origin set by the simulation
+# (the fake Tuya cloud), keeping one connection per session as the library
+# does
+#
+
+import http.client
+import json as host_json
+import urllib.parse
+
+origin = None
+
+class Response (object):
+    def __init__ (self, status_code, reason, headers, content):
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, *args):
+        self.close ()
+
+    @property
+    def text (self):
+        return self.content.decode ('utf-8')
+
+    def json (self):
+        return host_json.loads (self.content)
+
+    def iter_content (self, chunk_size=1, decode_unicode=False):
+        for index in range (0, len (self.content), chunk_size):
+            yield self.content[index:index + chunk_size]
+
+    def close (self):
+        pass
+
+class Session (object):
+    def __init__ (self, socket_pool, ssl_context=None, session_id=None):
+        self.socket_pool = socket_pool
+        self.ssl_context = ssl_context
+        self.connection = None
+        self.requests = 0
+
+    def request (self, method, url, data=None, json=None, headers=None, stream=False, timeout=60):
+        target = urllib.parse.urlsplit (url)
+        server = urllib.parse.urlsplit (origin or url)
+
+        if json is not None:
+            data = host_json.dumps (json)
+
+        if isinstance (data, str):
+            data = data.encode ('utf-8')
+
+        path = target.path + (f'?{target.query}' if target.query else '')
+
+        if self.connection is None:
+            self.connection = http.client.HTTPConnection (server.hostname, server.port, timeout=timeout)
+
+        try:
+            self.connection.request (method, path, body=data, headers=headers or {})
+            response = self.connection.getresponse ()
+        except (ConnectionError, http.client.HTTPException):
+            self.connection.close ()
+            self.connection = None
+            raise
+
+        self.requests += 1
+        return Response (response.status, response.reason, dict (response.getheaders ()), response.read ())
+
+    def get (self, url, **kwargs):
+        return self.request ('GET', url, **kwargs)
+
+    def post (self, url, **kwargs):
+        return self.request ('POST', url, **kwargs)
+
+    def put (self, url, **kwargs):
+        return self.request ('PUT', url, **kwargs)
+
+    def delete (self, url, **kwargs):
+        return self.request ('DELETE', url, **kwargs)
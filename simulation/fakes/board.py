@@ -0,0 +1,22 @@
+#
+# host stand-in for the CircuitPython board module, where every pin name
+# resolves to a named pin
+#
+
+class Pin (object):
+    def __init__ (self, name):
+        self.name = name
+
+    def __repr__ (self):
+        return f'board.{self.name}'
+
+pins = {}
+
+def __getattr__ (name):
+    if name.startswith ('__'):
+        raise AttributeError (name)
+
+    if name not in pins:
+        pins[name] = Pin (name)
+
+    return pins[name]
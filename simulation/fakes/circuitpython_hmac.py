@@ -0,0 +1,5 @@
+#
+# host stand-in for the circuitpython_hmac library
+#
+
+from hmac import HMAC, new, compare_digest
@@ -0,0 +1,57 @@
+#
+# host stand-in for the CircuitPython digitalio module
+#
+# inputs read their pull (so an idle button reads high) and every output
+# change is recorded in DigitalInOut.history
+#
+
+import time
+
+class Direction (object):
+    INPUT = 'input'
+    OUTPUT = 'output'
+
+class Pull (object):
+    UP = 'up'
+    DOWN = 'down'
+
+class DriveMode (object):
+    PUSH_PULL = 'push_pull'
+    OPEN_DRAIN = 'open_drain'
+
+class DigitalInOut (object):
+    #
+    # (time, pin, value) for every output change
+    #
+    history = []
+
+    def __init__ (self, pin):
+        self.pin = pin
+        self.direction = Direction.INPUT
+        self.drive_mode = DriveMode.PUSH_PULL
+        self.pull = None
+        self.level = False
+
+    @property
+    def value (self):
+        if self.direction == Direction.INPUT and self.pull is not None:
+            return self.pull == Pull.UP
+
+        return self.level
+
+    @value.setter
+    def value (self, value):
+        self.level = bool (value)
+        self.history.append ((time.monotonic (), getattr (self.pin, 'name', str (self.pin)), self.level))
+
+    def switch_to_output (self, value=False, drive_mode=DriveMode.PUSH_PULL):
+        self.direction = Direction.OUTPUT
+        self.drive_mode = drive_mode
+        self.value = value
+
+    def switch_to_input (self, pull=None):
+        self.direction = Direction.INPUT
+        self.pull = pull
+
+    def deinit (self):
+        pass
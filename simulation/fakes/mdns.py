@@ -0,0 +1,18 @@
+#
+# host stand-in for the CircuitPython mdns module
+#
+
+class Server (object):
+    def __init__ (self, network_interface):
+        self.hostname = None
+        self.instance_name = None
+        self.services = []
+
+    def advertise_service (self, *, service_type, protocol, port, txt_records=None):
+        self.services.append ((service_type, protocol, port))
+
+    def find (self, service_type, protocol, *, timeout=1):
+        return ()
+
+    def deinit (self):
+        pass
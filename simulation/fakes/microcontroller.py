@@ -0,0 +1,36 @@
+#
+# host stand-in for the CircuitPython microcontroller module
+#
+# a reset ends the simulation by raising Reset, and the non-volatile memory
+# is a plain bytearray that the simulation may preload
+#
+
+class Reset (SystemExit):
+    pass
+
+class Pins (object):
+    def __getattr__ (self, name):
+        if name.startswith ('__'):
+            raise AttributeError (name)
+
+        return name
+
+class Processor (object):
+    frequency = 240000000
+    temperature = 40.0
+    voltage = 3.3
+    uid = b'\x02\xc0\xff\xee\x00\x01'
+
+pin = Pins ()
+cpu = Processor ()
+nvm = bytearray (8192)
+
+resets = 0
+
+def reset ():
+    global resets
+    resets += 1
+    raise Reset ('microcontroller.reset')
+
+def on_next_reset (run_mode):
+    pass
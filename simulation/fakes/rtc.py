@@ -0,0 +1,17 @@
+#
+# host stand-in for the CircuitPython rtc module, where the host clock is
+# already correct and survives a simulated reset
+#
+
+import time
+
+class RTC (object):
+    updates = 0
+
+    @property
+    def datetime (self):
+        return time.gmtime ()
+
+    @datetime.setter
+    def datetime (self, value):
+        RTC.updates += 1
@@ -0,0 +1,67 @@
+#
+# host stand-in for the CircuitPython socketpool module
+#
+# sockets are host sockets, accepted connections are non-blocking as on the
+# device, strings are sent as their UTF-8 buffer as MicroPython does, and
+# bound ports can be remapped (SocketPool.ports) so that the web server does
+# not need to run privileged
+#
+
+import socket as host
+
+class Socket (object):
+    def __init__ (self, sock):
+        self.sock = sock
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, *args):
+        self.close ()
+
+    def __getattr__ (self, name):
+        return getattr (self.sock, name)
+
+    def bind (self, address):
+        host_address, port = address
+        self.sock.bind ((host_address, SocketPool.ports.get (port, port)))
+
+    def accept (self):
+        sock, address = self.sock.accept ()
+        sock.setblocking (False)
+        return Socket (sock), address
+
+    def send (self, data):
+        if isinstance (data, str):
+            data = data.encode ('utf-8')
+
+        return self.sock.send (data)
+
+    def close (self):
+        self.sock.close ()
+
+class SocketPool (object):
+    AF_INET = host.AF_INET
+    SOCK_STREAM = host.SOCK_STREAM
+    SOCK_DGRAM = host.SOCK_DGRAM
+    SOL_SOCKET = host.SOL_SOCKET
+    SO_REUSEADDR = host.SO_REUSEADDR
+    IPPROTO_TCP = host.IPPROTO_TCP
+    TCP_NODELAY = host.TCP_NODELAY
+    EAGAIN = 11
+
+    #
+    # port remapping applied when binding
+    #
+    ports = {}
+
+    def __init__ (self, radio):
+        self.radio = radio
+
+    def socket (self, family=AF_INET, type=SOCK_STREAM, proto=0):
+        sock = host.socket (family, type, proto)
+        sock.setsockopt (host.SOL_SOCKET, host.SO_REUSEADDR, 1)
+        return Socket (sock)
+
+    def getaddrinfo (self, host_name, port, family=0, type=0, proto=0, flags=0):
+        return host.getaddrinfo (host_name, port, family, type, proto, flags)
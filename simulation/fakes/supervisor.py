@@ -0,0 +1,25 @@
+#
+# host stand-in for the CircuitPython supervisor module
+#
+
+import time
+
+class SafeModeReason (object):
+    NONE = None
+    BROWNOUT = 'brownout'
+    HARD_FAULT = 'hard_fault'
+    WATCHDOG = 'watchdog'
+
+class Runtime (object):
+    safe_mode_reason = SafeModeReason.NONE
+    autoreload = False
+    serial_connected = True
+    usb_connected = False
+
+runtime = Runtime ()
+
+def ticks_ms ():
+    return int (time.monotonic () * 1000) & ((1 << 29) - 1)
+
+def reload ():
+    pass
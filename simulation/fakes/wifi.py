@@ -0,0 +1,237 @@
+#
+# host stand-in for the CircuitPython wifi module
+#
+# the radio connects to any network listed in radio.networks and the monitor
+# replays a capture, set by the simulation, against a shared timeline so that
+# frames arriving while no monitor is running are missed just as on the
+# device
+#
+
+import collections
+import time
+
+class Packet (object):
+    CH = 'ch'
+    LEN = 'len'
+    RAW = 'raw'
+    RSSI = 'rssi'
+
+class Network (object):
+    def __init__ (self, ssid, bssid=b'\x02\x00\x00\x00\x00\x01', channel=6, rssi=-50):
+        self.ssid = ssid
+        self.bssid = bssid
+        self.channel = channel
+        self.rssi = rssi
+        self.country = ''
+        self.authmode = []
+
+class Radio (object):
+    def __init__ (self):
+        self.enabled = True
+        self.hostname = 'proximity'
+        self.mac_address = b'\x02\xc0\xff\xee\x00\x01'
+        self.mac_address_ap = b'\x02\xc0\xff\xee\x00\x02'
+
+        self.networks = []
+        self.connected = False
+        self.ap_info = None
+        self.ap_active = False
+        self.ipv4_address = None
+        self.ipv4_address_ap = None
+
+    def start_scanning_networks (self, *, start_channel=1, stop_channel=11):
+        return iter (list (self.networks))
+
+    def stop_scanning_networks (self):
+        pass
+
+    def connect (self, ssid, password='', *, channel=0, bssid=None, timeout=None):
+        for network in self.networks:
+            if network.ssid != ssid:
+                continue
+
+            if bssid is not None and network.bssid != bssid:
+                continue
+
+            if channel and network.channel != channel:
+                continue
+
+            self.connected = True
+            self.ap_info = network
+            self.ipv4_address = '127.0.0.1'
+            return
+
+        raise ConnectionError ('No network with that ssid')
+
+    def disconnect (self):
+        self.connected = False
+        self.ap_info = None
+        self.ipv4_address = None
+
+    def stop_station (self):
+        self.disconnect ()
+
+    def start_ap (self, ssid, password='', *, channel=1, authmode=None, max_connections=4):
+        self.ap_active = True
+        self.ipv4_address_ap = '127.0.0.1'
+
+    def stop_ap (self):
+        self.ap_active = False
+        self.ipv4_address_ap = None
+
+radio = Radio ()
+
+class Monitor (object):
+    #
+    # replayed frames as (timestamp, channel, rssi, raw) tuples, the replay
+    # speed and whether to loop at the end of the capture
+    #
+    capture = []
+    speed = 1.0
+    loop = False
+
+    #
+    # shared replay timeline
+    #
+    origin = None
+    cursor = 0
+    cycle = 0.0
+
+    #
+    # frames replayed so far, and those that arrived while no monitor was
+    # listening
+    #
+    offered = 0
+    missed = 0
+
+    #
+    # signal level reported for frames captured without one
+    #
+    rssi = -60
+
+    active = None
+
+    def __init__ (self, channel=1, queue=128):
+        self.channel = channel
+        self.depth = queue
+        self.queue = collections.deque ()
+        self.dropped = 0
+
+        #
+        # skip anything that arrived before the monitor started
+        #
+        Monitor.step (None)
+        Monitor.active = self
+
+    @classmethod
+    def replay (cls, capture, speed=1.0, loop=False):
+        cls.capture = capture
+        cls.speed = speed
+        cls.loop = loop
+        cls.origin = time.monotonic ()
+        cls.cursor = 0
+        cls.cycle = 0.0
+        cls.offered = 0
+        cls.missed = 0
+
+    @classmethod
+    def elapsed (cls):
+        if cls.origin is None:
+            cls.origin = time.monotonic ()
+
+        return (time.monotonic () - cls.origin) * cls.speed
+
+    @classmethod
+    def update (cls):
+        #
+        # bring the replay up to date whether or not a monitor is running
+        #
+        cls.step (cls.active)
+
+    def advance (self):
+        Monitor.step (self)
+
+    @classmethod
+    def step (cls, monitor):
+        #
+        # move every frame that is due into the queue of the monitor, or
+        # count it as missed without one
+        #
+        capture = Monitor.capture
+        if not capture:
+            return
+
+        start = capture[0][0]
+        elapsed = Monitor.elapsed ()
+
+        while True:
+            if Monitor.cursor >= len (capture):
+                if not Monitor.loop:
+                    return
+
+                Monitor.cycle += capture[-1][0] - start + 0.001
+                Monitor.cursor = 0
+
+            timestamp, channel, rssi, raw = capture[Monitor.cursor]
+            if timestamp - start + Monitor.cycle > elapsed:
+                return
+
+            Monitor.cursor += 1
+            Monitor.offered += 1
+
+            if monitor is None:
+                Monitor.missed += 1
+                continue
+
+            monitor.receive (channel, rssi, raw)
+
+    def receive (self, channel, rssi, raw):
+        if channel is not None and channel != self.channel:
+            return
+
+        if len (self.queue) >= self.depth:
+            self.dropped += 1
+            return
+
+        self.queue.append ((channel, rssi, raw))
+
+    @classmethod
+    def inject (cls, raw, rssi=-50, channel=None):
+        #
+        # deliver a frame immediately to the running monitor
+        #
+        if cls.active is None:
+            cls.missed += 1
+            return False
+
+        cls.active.receive (channel, rssi, raw)
+        return True
+
+    def packet (self):
+        self.advance ()
+
+        if not self.queue:
+            return {}
+
+        channel, rssi, raw = self.queue.popleft ()
+        return {
+            Packet.CH: channel if channel is not None else self.channel,
+            Packet.LEN: len (raw),
+            Packet.RAW: raw,
+            Packet.RSSI: rssi if rssi is not None else Monitor.rssi
+        }
+
+    def lost (self):
+        self.advance ()
+
+        count = self.dropped
+        self.dropped = 0
+        return count
+
+    def queued (self):
+        self.advance ()
+        return len (self.queue)
+
+    def deinit (self):
+        if Monitor.active is self:
+            Monitor.active = None
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+#
+# run source/code.py on a workstation
+#
+# stand-in CircuitPython modules from simulation/fakes are put ahead of the
+# source on the import path, wifi.Monitor replays a pcap (radiotap or raw
+# 802.11) or a synthesized capture, and Tuya requests go to a local fake
+# cloud. main () and every task then run unchanged under CPython.
+#
+# the pure Python libraries fetched by the Makefile (biplane in particular)
+# are taken from the directories given with --lib, or from site-packages
+#
+#   python simulation/simulate.py --lib .cache --synthesize 60 --speed 4
+#   python simulation/simulate.py --lib .cache --capture home.pcap --port 8080
+#   python simulation/simulate.py --lib .cache --bundle --duration 30
+#
+
+import argparse
+import asyncio
+import gc
+import importlib.util
+import json
+import os
+import shutil
+import sys
+import tempfile
+import tracemalloc
+
+HERE = os.path.dirname (os.path.abspath (__file__))
+SOURCE = os.path.join (os.path.dirname (HERE), 'source')
+FAKES = os.path.join (HERE, 'fakes')
+TOOLS = os.path.join (os.path.dirname (HERE), 'tools')
+
+#
+# heap size reported through gc.mem_free (), roughly that of an ESP32 running
+# CircuitPython with WiFi up
+#
+HEAP = 128 * 1024
+
+def install (libs=(), heap=HEAP):
+    #
+    # put the stand-in modules and the firmware source on the import path
+    #
+    for path in reversed ([FAKES, SOURCE] + [os.path.abspath (lib) for lib in libs]):
+        if path not in sys.path:
+            sys.path.insert (0, path)
+
+    #
+    # report heap use from tracemalloc when it is running
+    #
+    def mem_alloc ():
+        if tracemalloc.is_tracing ():
+            return tracemalloc.get_traced_memory ()[0]
+        return 0
+
+    def mem_free ():
+        return max (0, heap - mem_alloc ())
+
+    if not hasattr (gc, 'mem_free'):
+        gc.mem_free = mem_free
+        gc.mem_alloc = mem_alloc
+
+def stage (configuration, bundle=False):
+    #
+    # build a working directory laid out like the device filesystem
+    #
+    root = tempfile.mkdtemp (prefix='proximity-')
+
+    with open (os.path.join (root, 'secrets.json'), 'w') as file:
+        json.dump (configuration, file, indent=4)
+
+    #
+    # the assets as the Makefile stages them, or straight from the source
+    #
+    if bundle:
+        shutil.copytree (os.path.join (SOURCE, 'assets'), os.path.join (root, 'assets'))
+
+        sys.path.insert (0, TOOLS)
+        import bundle as bundler
+        bundler.bundle (os.path.join (root, 'assets'))
+        bundler.manifest (os.path.join (root, 'assets'))
+    else:
+        os.symlink (os.path.join (SOURCE, 'assets'), os.path.join (root, 'assets'))
+
+    return root
+
+def load ():
+    #
+    # forget the modules code.py loaded for an earlier simulation, so that
+    # their class level state starts over
+    #
+    for name, module in list (sys.modules.items ()):
+        if os.path.dirname (os.path.abspath (getattr (module, '__file__', None) or '/')) == SOURCE:
+            del sys.modules[name]
+
+    #
+    # import code.py under its own name, without running the entry point
+    #
+    spec = importlib.util.spec_from_file_location ('proximity', os.path.join (SOURCE, 'code.py'))
+    module = importlib.util.module_from_spec (spec)
+    sys.modules['proximity'] = module
+    spec.loader.exec_module (module)
+    return module
+
+class Simulation (object):
+    def __init__ (self, configuration, frames=(), speed=1.0, loop=False, port=8080, channel=6, libs=(), bundle=False):
+        install (libs)
+
+        import socketpool
+        import wifi
+        import adafruit_requests
+
+        from cloud import Cloud
+
+        self.configuration = configuration
+        self.cloud = Cloud.from_configuration (configuration)
+        adafruit_requests.origin = self.cloud.origin
+
+        #
+        # make every configured network visible on the given channel
+        #
+        wifi.radio.networks = [
+            wifi.Network (ssid, bssid=bytes ((0x02, 0, 0, 0, 0, index + 1)), channel=channel)
+            for index, ssid in enumerate (configuration.get ('wifi', {}))
+        ]
+
+        wifi.Monitor.replay (list (frames), speed, loop)
+        socketpool.SocketPool.ports[80] = port
+
+        self.root = stage (configuration, bundle)
+        self.cwd = os.getcwd ()
+        os.chdir (self.root)
+
+        self.module = load ()
+
+    async def run (self, duration=None):
+        try:
+            await asyncio.wait_for (self.module.main (), duration)
+        except asyncio.TimeoutError:
+            pass
+
+    def close (self):
+        os.chdir (self.cwd)
+        shutil.rmtree (self.root, ignore_errors=True)
+        self.cloud.close ()
+
+    def summary (self):
+        import digitalio
+        import wifi
+
+        return {
+            'frames': len (wifi.Monitor.capture),
+            'missed': wifi.Monitor.missed,
+            'cloud': {
+                'requests': len (self.cloud.requests),
+                'commands': self.cloud.commands and [
+                    {'device': device, 'commands': commands} for _, device, commands in self.cloud.commands
+                ],
+                'devices': self.cloud.devices
+            },
+            'gpio': [(pin, value) for _, pin, value in digitalio.DigitalInOut.history]
+        }
+
+def frames_from (arguments, configuration):
+    from capture import read, synthesize
+
+    if arguments.capture:
+        return read (arguments.capture)
+
+    return synthesize (list (configuration.get ('beacon', {})), duration=arguments.synthesize, channel=arguments.channel)
+
+def main ():
+    parser = argparse.ArgumentParser (description='run the proximity firmware against a recorded capture')
+    parser.add_argument ('--config', default=os.path.join (HERE, 'config.json'), help='configuration to use as secrets.json')
+    parser.add_argument ('--capture', help='pcap file to replay through wifi.Monitor')
+    parser.add_argument ('--synthesize', type=float, default=60.0, help='seconds of traffic to synthesize without a capture')
+    parser.add_argument ('--speed', type=float, default=1.0, help='replay speed relative to the capture timestamps')
+    parser.add_argument ('--loop', action='store_true', help='restart the capture when it ends')
+    parser.add_argument ('--duration', type=float, help='seconds to run for, forever by default')
+    parser.add_argument ('--port', type=int, default=8080, help='local port for the web server')
+    parser.add_argument ('--channel', type=int, default=6, help='channel of the simulated access point')
+    parser.add_argument ('--lib', action='append', default=[], help='directory with additional libraries (biplane)')
+    parser.add_argument ('--bundle', action='store_true', help='minify and compress the assets like the Makefile')
+    arguments = parser.parse_args ()
+
+    sys.path.insert (0, HERE)
+
+    with open (arguments.config) as file:
+        configuration = json.load (file)
+
+    simulation = Simulation (
+        configuration,
+        frames_from (arguments, configuration),
+        speed=arguments.speed,
+        loop=arguments.loop,
+        port=arguments.port,
+        channel=arguments.channel,
+        libs=arguments.lib,
+        bundle=arguments.bundle
+    )
+
+    try:
+        asyncio.run (simulation.run (arguments.duration))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        simulation.close ()
+        print (json.dumps (simulation.summary (), indent=4))
+
+if __name__ == '__main__':
+    main ()
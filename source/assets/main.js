@@ -217,7 +217,7 @@ $(document).ready(function() {
     //
     // get the configuration data
     //
-    $.getJSON ('secrets.json')
+    $.getJSON ('api/v1/config')
         .done (function (data) {
 
             process_configuration (data);
@@ -263,6 +263,41 @@ $('.proximity-apply_changes').click (function () {
     console.log (configuration);
 });
 
+//
+// follow the live state pushed by the device
+//
+function output_item (name) {
+    let item = $('.proximity-outputs li').filter (function () {
+        return $(this).data ('name') == name;
+    });
+
+    if (item.length == 0) {
+        item = $('<li>').data ('name', name);
+        $('.proximity-outputs').append (item);
+    }
+
+    return item;
+}
+
+if (window.EventSource) {
+    const events = new EventSource ('api/v1/events');
+
+    events.addEventListener ('location', (event) => {
+        const data = JSON.parse (event.data);
+        $('.proximity-location').text (data.location || 'unknown');
+    });
+
+    events.addEventListener ('output', (event) => {
+        const data = JSON.parse (event.data);
+        output_item (data.name).text (data.name + ': ' + (data.known ? (data.state ? 'on' : 'off') : 'unknown'));
+    });
+
+    events.addEventListener ('beacon', (event) => {
+        const data = JSON.parse (event.data);
+        $('.proximity-beacon').text (data.name + (data.present ? ' arrived' : ' left') + ' at ' + data.rssi + ' dBm (' + new Date ().toLocaleTimeString () + ')');
+    });
+}
+
 //
 // restart the system
 //
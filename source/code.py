@@ -1,9 +1,14 @@
 #!/usr/bin/env python
 
-import adafruit_hashlib as hashlib
-import adafruit_ntp as ntp
-import adafruit_requests as requests
-import circuitpython_hmac as hmac
+#
+# note the time before anything else is loaded, to report how long the
+# start up took
+#
+import time
+
+started = time.monotonic_ns () // 1000000
+
+import adafruit_ticks as ticks
 
 import asyncio
 import binascii
@@ -13,300 +18,754 @@ import gc
 import json
 import mdns
 import microcontroller
-import os
-import socketpool
-import ssl
+import struct
 import sys
-import time
-import traceback
 import wifi
 
-import biplane
-
-BUSY = 0
+from core import DEBUG, INFO, Clock, Events, GPIOOutput, Log, Memory, Output
+from core import debug, emphasis, error, exception, info, warn
 
 # ------------------------------------------------------------
 
-def logger (text):
-    print (text)
+class Frame (object):
+    #
+    # frame types from the frame control field
+    #
+    MANAGEMENT = 0
+    CONTROL = 1
+    DATA = 2
 
-def info (text):
-    logger (f'info - {text}')
+    #
+    # first frame control byte (subtype and type) of the common frames
+    #
+    KINDS = {
+        'association-request': 0x00,
+        'association-response': 0x10,
+        'reassociation-request': 0x20,
+        'reassociation-response': 0x30,
+        'probe-request': 0x40,
+        'probe-response': 0x50,
+        'beacon': 0x80,
+        'disassociation': 0xa0,
+        'authentication': 0xb0,
+        'deauthentication': 0xc0,
+        'action': 0xd0,
+        'block-ack-request': 0x84,
+        'block-ack': 0x94,
+        'ps-poll': 0xa4,
+        'rts': 0xb4,
+        'cts': 0xc4,
+        'ack': 0xd4,
+        'data': 0x08,
+        'null-data': 0x48,
+        'qos-data': 0x88,
+        'qos-null': 0xc8
+    }
 
-def warn (text):
-    logger (f'warning - {text}')
+    #
+    # frames that a phone or laptop transmits on its own
+    #
+    PRESENCE = ('probe-request', 'data', 'null-data', 'qos-data', 'qos-null')
 
-def error (text):
-    logger (f'error - {text}')
+    #
+    # fixed offsets of the 802.11 header address fields
+    #
+    RECEIVER = 4
+    TRANSMITTER = 10
+    BSSID = 16
+    SOURCE = 24
+
+    ROLES = {
+        RECEIVER: 'receiver',
+        TRANSMITTER: 'transmitter',
+        BSSID: 'bssid',
+        SOURCE: 'source'
+    }
 
-def fixme (text):
-    logger (f'FIXME :: {text}')
+    #
+    # address fields present in each frame layout, in the order they are
+    # checked for a match
+    #
+    ADDRESSES = (TRANSMITTER, RECEIVER, BSSID)
+    BRIDGED = (TRANSMITTER, RECEIVER, BSSID, SOURCE)
+    PAIR = (TRANSMITTER, RECEIVER)
+    SINGLE = (RECEIVER,)
+    NONE = ()
 
-def emphasis (text):
-    length = len (text) + 6
-    logger ('*' * length)
-    logger (f'** {text} **')
-    logger ('*' * length)
+    #
+    # lookup table of allowed first frame control bytes, all by default
+    #
+    allowed = bytearray (b'\x01' * 256)
 
-# ------------------------------------------------------------
+    @classmethod
+    def allow (cls, kinds=None):
+        #
+        # restrict the frames passed to the beacon lookup, where None
+        # allows every frame
+        #
+        if kinds is None:
+            for index in range (256):
+                cls.allowed[index] = 1
+            return
+
+        for index in range (256):
+            cls.allowed[index] = 0
+
+        for kind in kinds:
+            value = kind if isinstance (kind, int) else cls.KINDS.get (kind)
+
+            if value is None:
+                warn (f'ignoring unknown frame type {kind}')
+                continue
+
+            #
+            # allow the value with any protocol version bits
+            #
+            for version in range (4):
+                cls.allowed[(value & 0xfc) | version] = 1
+
+    @classmethod
+    def accept (cls, raw):
+        return len (raw) >= 10 and cls.allowed[raw[0]] == 1
 
-class Frame (object):
     @classmethod
     def hex (cls, raw):
         return binascii.hexlify (raw, ':').decode ('utf-8')
 
+    @classmethod
+    def address (cls, text):
+        return binascii.unhexlify (text.replace (':', '').replace ('-', ''))
+
+    @classmethod
+    def split (cls, address, offset=0):
+        #
+        # split an address into two small integer keys (OUI and NIC parts)
+        # so that it can be looked up without allocating
+        #
+        high = (address[offset] << 16) | (address[offset + 1] << 8) | address[offset + 2]
+        low = (address[offset + 3] << 16) | (address[offset + 4] << 8) | address[offset + 5]
+        return high, low
+
+    #
+    # header decoding, indexing the raw buffer (bytes or memoryview) in place
+    #
     @classmethod
     def framecontrol (cls, raw):
-        return raw[0] << 8 + raw[1]
+        return (raw[0] << 8) | raw[1]
 
     @classmethod
-    def is_rts (cls, raw):
-        return cls.framecontrol (raw) == 0xb400
+    def kind (cls, raw):
+        return raw[0] & 0xfc
 
-# ------------------------------------------------------------
+    @classmethod
+    def type (cls, raw):
+        return (raw[0] >> 2) & 0x03
 
-class Output (object):
-    inventory = {}
+    @classmethod
+    def subtype (cls, raw):
+        return raw[0] >> 4
 
     @classmethod
-    def factory (cls, id, config):
-        try:
-            temp = config.get ('type', 'output')
+    def to_ds (cls, raw):
+        return (raw[1] & 0x01) != 0
+
+    @classmethod
+    def from_ds (cls, raw):
+        return (raw[1] & 0x02) != 0
+
+    @classmethod
+    def offsets (cls, raw):
+        type = (raw[0] >> 2) & 0x03
+
+        if type == cls.MANAGEMENT:
+            return cls.ADDRESSES
+
+        if type == cls.DATA:
+            if (raw[1] & 0x03) == 0x03:
+                return cls.BRIDGED
+            return cls.ADDRESSES
+
+        if type == cls.CONTROL:
+            #
+            # CTS and ACK frames only carry the receiver address
+            #
+            kind = raw[0] & 0xfc
+            if kind == 0xc4 or kind == 0xd4:
+                return cls.SINGLE
+            return cls.PAIR
+
+        return cls.NONE
+
+    @classmethod
+    def is_rts (cls, raw):
+        return cls.kind (raw) == cls.KINDS['rts']
+
+class Beacon (object):
+    inventory = {}
+
+    #
+    # enabled beacons keyed by the NIC and then the OUI part of the address
+    #
+    index = {}
 
-            if temp == 'gpio':
-                return GPIOOutput (id, config)
+    #
+    # beacons matched since the last check
+    #
+    fired = set ()
 
-            if temp == 'led':
-                return LEDOutput (id, config)
+    #
+    # beacons currently counted as present
+    #
+    present = set ()
+
+    #
+    # location of the current routing
+    #
+    location = None
+
+    #
+    # default signal levels in dBm to arrive and to leave, kept apart so
+    # that a beacon at the edge of range does not flap, seconds without a
+    # frame before a beacon has left, and the smoothing of the signal level
+    # as a power of two
+    #
+    enter = -80
+    leave = -90
+    away = 120
+    smoothing = 2
 
-            if temp == 'tuya':
-                return TuyaOutput (id, config)
+    @classmethod
+    def configure (cls, config):
+        cls.enter = config.get ('enter', cls.enter)
+        cls.leave = config.get ('leave', cls.leave)
+        cls.away = config.get ('away', cls.away)
+        cls.smoothing = config.get ('smoothing', cls.smoothing)
 
-            return Output (id, config)
+    @classmethod
+    def factory (cls, id, config):
+        try:
+            return Beacon (id, config)
         except Exception as e:
-            logger ('\n'.join (traceback.format_exception (e)))
+            exception (e)
 
     def __init__ (self, id, config):
-        self.name = id
-        self.config = config
+        self.macid = id
+        self.address = None
+        self.enabled = config['enabled']
+        self.name = config['name']
+        self.frames = 0
+        self.field = None
+        self.outputs = []
 
-        self.type = self.config.get ('type', 'output')
-        self.enabled = self.config.get ('enabled', True)
-        self.timeout = self.config.get ('timeout', 30 * 60)
+        self.enter = config.get ('enter', Beacon.enter)
+        self.leave = min (self.enter, config.get ('leave', Beacon.leave))
 
-        self.pending = False
-        self.known = False
-        self.state = False
-        self.last = time.time ()
+        #
+        # streaming statistics, with the signal level in 1/16 dBm and the
+        # time of the last frame in ticks so that matching does not allocate,
+        # where only frames the beacon transmitted itself measure the level
+        #
+        self.level = 0
+        self.heard = False
+        self.seen = None
+        self.channel = None
+        self.rate = 0.0
+        self.counted = ticks.ticks_ms ()
 
+        #
+        # only parse the address of enabled beacons, so that a placeholder
+        # for an unused one is harmless
+        #
         if self.enabled:
+            self.address = Frame.address (id)
             self.inventory[id] = self
 
+            high, low = Frame.split (self.address)
+            if low not in self.index:
+                self.index[low] = {}
+            self.index[low][high] = self
+
     def __str__ (self):
-        delta = time.time () - self.last
-        return f'{self.type:8} {self.name:24} {self.state:1} {"P" if self.pending else "_"} {"K" if self.known else "_"} {delta:5}'
+        return f'{self.name:10} {self.macid} {self.frames} {self.level / 16:6.1f} {self.rate:5.1f}'
 
-    def update (self, state=None):
+    @classmethod
+    def match (cls, raw, rssi, channel):
         #
-        # handle change of state
+        # look up each address field directly in the index, only building
+        # small integer keys so that unmatched frames do not allocate
         #
-        memory = gc.mem_free ()
-        logger (f'U: {self} {memory}')
+        size = len (raw)
+        for offset in Frame.offsets (raw):
+            if size < offset + 6:
+                continue
+
+            candidates = cls.index.get ((raw[offset + 3] << 16) | (raw[offset + 4] << 8) | raw[offset + 5])
+            if candidates is None:
+                continue
+
+            beacon = candidates.get ((raw[offset] << 16) | (raw[offset + 1] << 8) | raw[offset + 2])
+            if beacon is None:
+                continue
 
-        if state is not None:
-            if self.state != state:
-                self.pending = True
+            beacon.field = offset
+            beacon.frames += 1
 
-            if not self.known:
-                self.known = True
-                self.pending = True
+            #
+            # the signal of a frame sent to the beacon, or naming it as the
+            # BSSID or source, is that of whoever transmitted it
+            #
+            if offset == Frame.TRANSMITTER:
+                if not beacon.heard:
+                    beacon.level = rssi << 4
+                    beacon.heard = True
+                else:
+                    beacon.level += ((rssi << 4) - beacon.level) >> cls.smoothing
+
+            beacon.seen = ticks.ticks_ms ()
+            beacon.channel = channel
+
+            #
+            # wake the system monitor on the first frame since its last pass
+            #
+            if beacon not in cls.fired:
+                cls.fired.add (beacon)
+                Output.wake.set ()
+            if Log.level <= DEBUG:
+                debug (f'F: {beacon.name} {Frame.ROLES[offset]}')
 
-            self.state = state
-            self.last = time.time ()
+            return beacon
 
+        return None
+
+    def assess (self, now):
         #
-        # handle timeout
+        # fold the frames since the last pass into the frame rate, then
+        # return True on arrival, False on departure and None otherwise
         #
-        if time.time () - self.last > self.timeout:
-            logger (f'T: {self}')
-            self.update (False)
+        elapsed = ticks.ticks_diff (now, self.counted)
+        if elapsed > 0:
+            self.rate += (self.frames * 1000 / elapsed - self.rate) / 4
+            self.counted = now
+        self.frames = 0
 
-    @classmethod
-    def waiting (cls):
-        status = False
-        for name, output in cls.inventory.items ():
-            status |= output.pending
+        if self.seen is None:
+            return None
 
-        return status
+        gone = ticks.ticks_diff (now, self.seen) >= Beacon.away * 1000
+        level = self.level >> 4
+
+        if self not in Beacon.present:
+            if self.heard and not gone and level >= self.enter:
+                Beacon.present.add (self)
+                return True
+        elif gone or level < self.leave:
+            Beacon.present.discard (self)
+            return False
+
+        return None
 
     @classmethod
-    def synchronize (cls, mapping, location):
+    def assess_all (cls):
         #
-        # get the set of relevant outputs
+        # check the beacons that fired or are present, publishing arrivals
+        # and departures, and return those present that fired since the
+        # last pass, as frames too weak to count change nothing
         #
-        outputs = set ()
-        for beacon in mapping[location]:
-            outputs.update (mapping[location][beacon])
+        now = ticks.ticks_ms ()
+        active = []
+
+        for beacon in cls.fired | cls.present:
+            fired = beacon in cls.fired
+            change = beacon.assess (now)
+
+            if change is not None:
+                if Log.level <= INFO:
+                    info (f'{beacon.name} {"arrived" if change else "left"} at {beacon.level >> 4} dBm')
+                Events.publish ('beacon', beacon.summary (now))
+
+            if fired and beacon in cls.present:
+                active.append (beacon)
+
+        cls.fired.clear ()
+
+        return active
 
+    def summary (self, now):
+        return {
+            'name': self.name,
+            'present': self in Beacon.present,
+            'rssi': self.level >> 4 if self.heard else None,
+            'rate': round (self.rate, 1),
+            'channel': self.channel,
+            'age': ticks.ticks_diff (now, self.seen) // 1000 if self.seen is not None else None
+        }
+
+    @classmethod
+    def status (cls):
+        now = ticks.ticks_ms ()
+        return [beacon.summary (now) for beacon in cls.inventory.values ()]
+
+    @classmethod
+    def route (cls, mapping, location):
         #
-        # set any new output states
+        # link each beacon directly to its outputs for the location
         #
-        for name, output in cls.inventory.items ():
-            memory = gc.mem_free ()
-            logger (f'S: {output} {memory}')
-            output.activate ()
+        routes = mapping.get (location, {})
+        outputs = set ()
 
-    def activate (self):
-        self.pending = False
-        logger (f'A: {self}')
+        for beacon in cls.inventory.values ():
+            beacon.outputs = []
 
-# ------------------------------------------------------------
+            for name in routes.get (beacon.name, []):
+                if name in Output.inventory:
+                    beacon.outputs.append (Output.inventory[name])
+                    outputs.add (name)
 
-class GPIOOutput (Output):
-    gpio = {}
+        Output.scope (outputs)
+        Events.locate (location)
 
-    def __init__ (self, id, config):
-        super ().__init__ (id, config)
+        cls.location = location
 
-        self.output = config['pin']
+        if Log.level <= INFO:
+            info (f'routing {len (cls.inventory)} beacons to {len (outputs)} outputs for {location}')
 
-        if self.output not in self.gpio:
-            self.gpio[self.output] = digitalio.DigitalInOut (getattr (board, self.output))
-            self.gpio[self.output].direction = digitalio.Direction.OUTPUT
+# ------------------------------------------------------------
 
-    def activate (self):
-        if self.pending:
-            self.gpio[self.output].value = self.state
+class Channels (object):
+    #
+    # the monitor stays on the access point channel, where the connection
+    # lives and detection matters most, and makes short visits to the other
+    # configured channels, favouring those where beacons were last seen and
+    # staying on a little longer while a beacon keeps showing up there
+    #
+    extra = []
+    primary = None
+    current = None
 
-        super ().activate ()
+    #
+    # milliseconds on the primary channel between visits, milliseconds per
+    # visit, and the longest that matches may stretch a visit to
+    #
+    dwell = 2000
+    visit = 250
+    linger = 1000
 
-# ------------------------------------------------------------
+    #
+    # per channel frames, matches, visits and tick of the last match, with
+    # the credit used to share the visits out by weight
+    #
+    counts = {}
+    credit = {}
+    switched = 0
 
-class LEDOutput (GPIOOutput):
-    pass
+    @classmethod
+    def configure (cls, config):
+        cls.dwell = config.get ('dwell', cls.dwell)
+        cls.visit = config.get ('visit', cls.visit)
+        cls.linger = config.get ('linger', cls.linger)
+        cls.extra = list (config.get ('channels', cls.extra))
 
-# ------------------------------------------------------------
+    @classmethod
+    def start (cls, primary):
+        #
+        # (re)start on the primary channel of the current connection
+        #
+        cls.primary = primary
+        cls.current = primary
+        cls.switched = ticks.ticks_ms ()
 
-class TuyaOutput (Output):
-    http = None
+        for channel in [primary] + cls.extra:
+            if channel not in cls.counts:
+                cls.counts[channel] = [0, 0, 0, None]
 
-    def __init__ (self, id, config):
-        super ().__init__ (id, config)
-
-        self.output = config['name']
-        self.client_id = config['client_id']
-        self.client_secret = config['client_secret']
-        self.device_id = config['device_id']
-        self.output = config['name']
-        self.server = config['server']
-
-        self.timestamp = 0
-        self.token = ''
-        self.authorization = None
-
-    def request (self, pool, method, api, body = ''):
-        hash = hashlib.sha256 (body.encode ()).hexdigest ()
-        temp = f'{self.client_id}{self.token}{self.timestamp}{method}\n{hash}\n\n{api}'
-        sign = hmac.new (self.client_secret.encode (), temp.encode (), hashlib.sha256).hexdigest ().upper ()
-
-        headers = {
-            'sign_method': 'HMAC-SHA256',
-            'client_id': self.client_id,
-            't': str (self.timestamp),
-            'mode': 'cors',
-            'Content-Type': 'application/json',
-            'sign': sign
-        }
+        cls.credit = {channel: 0 for channel in cls.extra if channel != primary}
 
-        if self.token != '':
-            headers['access_token'] = self.token
+    @classmethod
+    def account (cls, channel, frames, matches):
+        #
+        # only the channels of the schedule are counted, which also skips
+        # frames drained before it has started
+        #
+        counts = cls.counts.get (channel)
+        if counts is None:
+            return
 
-        if self.http is None:
-            self.http = requests.Session (pool, ssl.create_default_context ())
+        counts[0] += frames
+        counts[1] += matches
 
-        with self.http.request (method, f'{self.server}{api}', headers=headers, data=body) as response:
-            data = response.json ()
+        if matches:
+            counts[3] = ticks.ticks_ms ()
 
-        gc.collect ()
+    @classmethod
+    def weight (cls, channel):
+        weight = 1
 
-        return data
+        for beacon in Beacon.inventory.values ():
+            if beacon.channel == channel:
+                weight += 1
 
-    def activate (self):
-        if self.pending:
-            pool = socketpool.SocketPool (wifi.radio)
+        return weight
 
-            #
-            # invalidate an older access token
-            #
-            now = int (time.mktime (ntp.NTP (pool, tz_offset=0).datetime) * 1000)
-            if now - self.timestamp > (self.timeout - 60):
-                self.timestamp = now
-                self.token = ''
+    @classmethod
+    def next (cls):
+        #
+        # the channel to listen on now
+        #
+        if not cls.credit:
+            return cls.current
 
-            #
-            # get a valid access token
-            #
-            if self.token == '':
-                response = self.request (pool,
-                    'GET',
-                    '/v1.0/token?grant_type=1'
-                )
-                self.authorization = response['result']
-                self.token = response['result']['access_token']
-                self.timeout = response['result']['expire_time']
+        now = ticks.ticks_ms ()
+        elapsed = ticks.ticks_diff (now, cls.switched)
+
+        if cls.current == cls.primary:
+            if elapsed < cls.dwell:
+                return cls.current
 
             #
-            # send the control request for the device
+            # visit the channel with the most credit, where each channel
+            # earns its weight on every visit
             #
-            data = { 'commands': [ { 'code': self.output, 'value': self.state == True } ] }
-            response = self.request (pool,
-                'POST',
-                f'/v1.0/iot-03/devices/{self.device_id}/commands',
-                json.dumps (data)
-            )
+            best = None
+            total = 0
+            for channel in cls.credit:
+                weight = cls.weight (channel)
+                cls.credit[channel] += weight
+                total += weight
+
+                if best is None or cls.credit[channel] > cls.credit[best]:
+                    best = channel
+
+            cls.credit[best] -= total
+            cls.counts[best][2] += 1
+
+            return cls.switch (best, now)
+
+        if elapsed < cls.visit:
+            return cls.current
+
+        #
+        # fast path, stay while beacons are showing up here, but not so
+        # long that the primary channel goes unwatched
+        #
+        last = cls.counts[cls.current][3]
+        if elapsed < cls.linger and last is not None and ticks.ticks_diff (now, last) < cls.visit:
+            return cls.current
+
+        return cls.switch (cls.primary, now)
+
+    @classmethod
+    def home (cls):
+        if cls.current != cls.primary:
+            cls.switch (cls.primary, ticks.ticks_ms ())
+
+        return cls.current
+
+    @classmethod
+    def switch (cls, channel, now):
+        cls.current = channel
+        cls.switched = now
+        return channel
 
-        super ().activate ()
+    @classmethod
+    def status (cls):
+        return {
+            'primary': cls.primary,
+            'current': cls.current,
+            'channels': {
+                str (channel): {'frames': counts[0], 'matches': counts[1], 'visits': counts[2]}
+                for channel, counts in cls.counts.items ()
+            }
+        }
 
 # ------------------------------------------------------------
 
-class Beacon (object):
-    inventory = {}
+class Sniffer (object):
+    #
+    # frames drained per lock acquisition, the time budget in milliseconds
+    # for one batch and the depth of the monitor queue
+    #
+    batch = 32
+    budget = 20
+    queue = 128
+
+    #
+    # how sniffing shares time with web traffic: keep draining the monitor
+    # ('concurrent'), stop draining but keep the monitor running ('pause')
+    # or stop the monitor until the server is idle ('restart')
+    #
+    http = 'concurrent'
+
+    #
+    # counters for reporting
+    #
+    frames = 0
+    matched = 0
+    lost = 0
+    batches = 0
+    backlog = 0
+    starts = 0
+
+    #
+    # frames lost and milliseconds spent in each state, where 'serving' is
+    # sniffing while the web server is busy
+    #
+    http_lost = 0
+    state = 'stopped'
+    since = 0
+    spent = {
+        'listening': 0,
+        'serving': 0,
+        'paused': 0,
+        'stopped': 0
+    }
+
+    #
+    # the web server responses, when the web server is loaded, to tell
+    # whether it is busy
+    #
+    server = None
 
     @classmethod
-    def factory (cls, id, config):
-        Beacon (id, config)
+    def busy (cls):
+        return cls.server is not None and cls.server.busy ()
 
-    def __init__ (self, id, config):
-        self.macid = id
-        self.enabled = config['enabled']
-        self.name = config['name']
-        self.frames = 0
+    @classmethod
+    def configure (cls, config):
+        cls.batch = config.get ('batch', cls.batch)
+        cls.budget = config.get ('budget', cls.budget)
+        cls.queue = config.get ('queue', cls.queue)
+        cls.http = config.get ('http', cls.http)
+        cls.since = ticks.ticks_ms ()
 
-        if self.enabled:
-            self.inventory[id] = self
+        #
+        # limit the frame types checked against the beacons
+        #
+        Frame.allow (config.get ('frames', Frame.PRESENCE))
 
-    def __str__ (self):
-        return f'{self.name:10} {self.macid} {self.frames}'
+    @classmethod
+    def drain (cls, monitor):
+        #
+        # process queued frames until the batch is full, the queue is empty
+        # or the time budget runs out
+        #
+        start = ticks.ticks_ms ()
+        count = 0
+        matches = 0
+
+        #
+        # frames and matches for the channel the frames were received on,
+        # which changes when frames from before a hop are still queued
+        #
+        channel = None
+        frames = 0
+        matched = 0
+
+        while count < cls.batch:
+            packet = monitor.packet ()
+            if not packet:
+                break
+
+            count += 1
+
+            if packet[wifi.Packet.CH] != channel:
+                Channels.account (channel, frames, matched)
+                channel = packet[wifi.Packet.CH]
+                frames = 0
+                matched = 0
+
+            frames += 1
+
+            #
+            # drop frames that cannot identify a beacon before looking for
+            # a match against the beacons
+            #
+            raw = packet[wifi.Packet.RAW]
+            if Frame.accept (raw):
+                if Beacon.match (raw, packet[wifi.Packet.RSSI], channel) is not None:
+                    matched += 1
+                    matches += 1
+
+            if ticks.ticks_diff (ticks.ticks_ms (), start) >= cls.budget:
+                break
+
+        Channels.account (channel, frames, matched)
+
+        cls.frames += count
+        cls.matched += matches
+        cls.batches += 1
+
+        return count
+
+    @classmethod
+    def account (cls, monitor, busy):
+        #
+        # keep track of frames dropped by the monitor queue
+        #
+        lost = monitor.lost ()
+        cls.lost += lost
+        if busy:
+            cls.http_lost += lost
+
+        cls.backlog = max (cls.backlog, monitor.queued ())
 
     @classmethod
-    def match (cls, raw):
-        dumb = Frame.hex (raw[0:22])
+    def enter (cls, state):
+        #
+        # charge the time since the last change to the previous state
+        #
+        now = ticks.ticks_ms ()
+        cls.spent[cls.state] += ticks.ticks_diff (now, cls.since)
+        cls.state = state
+        cls.since = now
 
-        for id, beacon in cls.inventory.items ():
-            if id in dumb:
-                logger ('-' * 35)
-                logger (f'F: {beacon.name}')
-                logger (dumb)
-                logger (' ' * dumb.index (id) + '-----------------')
-                beacon.frames += 1
+    @classmethod
+    def status (cls):
+        return {
+            'frames': cls.frames,
+            'matched': cls.matched,
+            'lost': cls.lost,
+            'batches': cls.batches,
+            'backlog': cls.backlog,
+            'starts': cls.starts,
+            'http': cls.http,
+            'http_lost': cls.http_lost,
+            'spent': cls.spent
+        }
 
 #
 # task to monitor beacon and timeout status
 #
 async def system_monitor_task (configuration, lock):
     while True:
-        gc.collect ()
-        await asyncio.sleep (1.0)
+        Memory.collect ()
+
+        #
+        # sleep until a beacon fires, an output changes or the next output
+        # timeout, checking the connection and location at least once a
+        # second until both are known
+        #
+        limit = 60
+        if not wifi.radio.connected or configuration['system']['location'] is None:
+            limit = 1
+        elif Output.waiting ():
+            limit = 1
+        else:
+            #
+            # come back when outputs held back by a backoff are due
+            #
+            deferred = Output.deferred ()
+            if deferred is not None:
+                limit = min (limit, deferred)
+
+            if Snapshot.pending:
+                limit = min (limit, Snapshot.interval)
+
+        try:
+            await asyncio.wait_for (Output.wake.wait (), Output.delay (limit))
+        except asyncio.TimeoutError:
+            pass
+
+        Output.wake.clear ()
 
         #
         # wait to be connected to an access point
@@ -323,38 +782,27 @@ async def system_monitor_task (configuration, lock):
 
         try:
             #
-            # process any new beacon frames
+            # rebuild the routing when the location changes, the
+            # configuration itself is only read at startup
             #
-            for name, beacon in Beacon.inventory.items ():
-                #DEBUG# logger (f'B: {beacon}')
-
-                #
-                # update outputs based on beacon activity
-                #
-                if beacon.frames > 0 and beacon.name in configuration['mapping'][location]:
-                    try:
-                        logger ('==========')
-                        logger (f'L: {location}')
-                        logger (f'M: {name}')
-                        logger (f'N: {beacon.name}')
-                        for output in configuration['mapping'][location][beacon.name]:
-                            logger (f'P: {output}')
-                            Output.inventory[output].update (True)
-                        logger ('==========')
-                    except Exception as e:
-                        logger ('\n'.join (traceback.format_exception (e)))
-
-                    beacon.frames = 0
+            if location != Beacon.location:
+                Beacon.route (configuration['mapping'], location)
 
             #
-            # update the state of all of the outputs in the local mapping
+            # keep the outputs on for the beacons that are present, where
+            # only an arrival changes an output state
             #
-            outputs = set ()
-            for items in configuration['mapping'][location].values ():
-                outputs.update (items)
+            for beacon in Beacon.assess_all ():
+                if Log.level <= DEBUG:
+                    debug (f'B: {beacon}')
 
-            for name in sorted (outputs):
-                Output.inventory[name].update ()
+                for output in beacon.outputs:
+                    output.update (True)
+
+            #
+            # turn off the outputs that have timed out
+            #
+            Output.expire ()
 
             #
             # temporarily release to the other tasks
@@ -365,11 +813,17 @@ async def system_monitor_task (configuration, lock):
             # apply any pending changes
             #
             if Output.waiting ():
-                async with lock:
-                    Output.synchronize (configuration['mapping'], location)
+                await Output.synchronize (lock)
+                Snapshot.pending = True
+
+            #
+            # record the changes, or those held back from an earlier pass
+            #
+            if Snapshot.pending:
+                Snapshot.save ()
 
         except Exception as e:
-            logger ('\n'.join (traceback.format_exception (e)))
+            exception (e)
 
 #
 # task to periodically resynchronize the output status
@@ -389,7 +843,7 @@ async def resynchronize_task (configuration, lock):
         #
         try:
             for name, output in Output.inventory.items ():
-                output.pending = True
+                output.mark ()
         except:
             pass
 
@@ -401,7 +855,7 @@ async def packet_sniffer_task (configuration, lock):
     # monitor packet headers on the current access point channel
     #
     while True:
-        gc.collect ()
+        Memory.collect ()
         await asyncio.sleep (1.0)
 
         #
@@ -411,313 +865,435 @@ async def packet_sniffer_task (configuration, lock):
             continue
 
         #
-        # wait until the outputs are synchronized
+        # only the restart mode waits for the outputs and the web server,
+        # otherwise the lock keeps the sniffer out while outputs change
         #
-        if Output.waiting ():
-            continue
+        if Sniffer.http == 'restart':
+            if Output.waiting ():
+                continue
 
-        #
-        # wait until the web server is idle
-        #
-        if BaseResponse.busy ():
-            continue
+            if Sniffer.busy ():
+                continue
 
         #
         # start monitoring packets
         #
-        monitor = wifi.Monitor (channel=wifi.radio.ap_info.channel)
+        monitor = wifi.Monitor (channel=wifi.radio.ap_info.channel, queue=Sniffer.queue)
+        Channels.start (wifi.radio.ap_info.channel)
+        Sniffer.starts += 1
 
-        emphasis (f'listening on channel {wifi.radio.ap_info.channel}')
+        if Log.level <= INFO:
+            emphasis (f'listening on channel {wifi.radio.ap_info.channel}')
 
+        running = True
         while wifi.radio.connected:
-            gc.collect ()
             await asyncio.sleep (0)
 
             try:
                 async with lock:
-                    #
-                    # temporarily stop to finish web responses
-                    #
-                    if BaseResponse.busy ():
-                        info ('waiting for http responses to complete')
-                        monitor.deinit ()
-                        break
+                    busy = Sniffer.busy ()
+
+                    if Sniffer.http == 'restart':
+                        #
+                        # temporarily stop to finish web responses
+                        #
+                        if busy:
+                            info ('waiting for http responses to complete')
+                            monitor.deinit ()
+                            running = False
+                            break
+
+                        #
+                        # temporarily stop to synchronize outputs
+                        #
+                        if Output.waiting ():
+                            info ('pausing packet analysis')
+                            monitor.deinit ()
+                            running = False
+                            break
+
+                    Sniffer.account (monitor, busy)
 
                     #
-                    # temporarily stop to synchronize outputs
+                    # leave the monitor running but let the web server have
+                    # the time while it is busy
                     #
-                    if Output.waiting ():
-                        info ('pausing packet analysis')
-                        monitor.deinit ()
-                        break
+                    if busy and Sniffer.http == 'pause':
+                        Sniffer.enter ('paused')
+                        count = 0
+                    else:
+                        Sniffer.enter ('serving' if busy else 'listening')
 
-                    #
-                    # get the next usable packet
-                    #
-                    packet = monitor.packet ()
+                        #
+                        # process a batch of queued packets
+                        #
+                        count = Sniffer.drain (monitor)
 
                     #
-                    # check for a match against the becaons
+                    # follow the channel schedule, staying on the access
+                    # point channel while the connection is in use
                     #
-                    Beacon.match (packet[wifi.Packet.RAW])
+                    if busy or Output.waiting ():
+                        channel = Channels.home ()
+                    else:
+                        channel = Channels.next ()
 
-                    #
-                    # clean up immediately
-                    #
-                    del packet
-            except:
-                pass
+                    if channel != monitor.channel:
+                        monitor.channel = channel
+
+                #
+                # clean up once per batch, or give the queue time to fill
+                #
+                if count > 0:
+                    Memory.collect ()
+                else:
+                    await asyncio.sleep (0.01)
+            except Exception as e:
+                exception (e)
+
+        if running:
+            monitor.deinit ()
+
+        Sniffer.enter ('stopped')
+
+        if Log.level <= INFO:
+            info (f'stopped packet analysis, {Sniffer.lost} frames lost')
 
-        info ('stopped packet analysis')
+# ------------------------------------------------------------
+
+class Link (object):
+    #
+    # the last access point joined, kept in non-volatile memory so that a
+    # dropped connection or a reboot can rejoin it directly, with a channel
+    # by channel scan of the known networks as the fallback
+    #
+    offset = 0
+    size = 48
+    MAGIC = 0xa5
 
-class BaseResponse (biplane.Response):
-    timestamp = 0
+    ssid = None
+    bssid = None
+    channel = None
+
+    #
+    # seconds to wait for a connection, the first and the longest delay
+    # after failed attempts, and the tick of the next attempt
+    #
+    timeout = 8
+    backoff = 2
+    limit = 300
+    retry = None
+
+    #
+    # counters for reporting
+    #
+    failures = 0
+    direct = 0
+    scans = 0
 
     @classmethod
-    def update (cls):
-        BaseResponse.timestamp = time.time ()
+    def configure (cls, config):
+        cls.timeout = config.get ('timeout', cls.timeout)
+        cls.backoff = config.get ('backoff', cls.backoff)
+        cls.limit = config.get ('limit', cls.limit)
 
     @classmethod
-    def busy (cls, delta=1):
-        return (time.time () - BaseResponse.timestamp) < delta
+    def load (cls):
+        record = microcontroller.nvm[cls.offset:cls.offset + cls.size]
+        if record[0] != cls.MAGIC or record[8] > cls.size - 9:
+            return
+
+        try:
+            cls.ssid = bytes (record[9:9 + record[8]]).decode ('utf-8')
+        except UnicodeError:
+            return
 
-    def __init__(self, status_code=200, content_type='text/plain', headers={}):
-        self.status_code = status_code
-        self.headers = headers
-        self.headers['content-type'] = content_type
-        self.update ()
+        cls.channel = record[1]
+        cls.bssid = bytes (record[2:8])
 
-    def serialize(self):
-        self.update ()
-        response = bytearray(f'HTTP/1.1 {self.status_code} {self.status_code}\r\n'.encode('ascii'))
-        yield response
+        info (f'last access point {cls.ssid} on channel {cls.channel}')
 
-        for name, value in self.headers.items():
-            yield f'{name}: {value}\r\n'.encode('ascii')
+    @classmethod
+    def save (cls, ssid, bssid, channel):
+        #
+        # only write when something changed to spare the flash
+        #
+        if ssid == cls.ssid and bssid == cls.bssid and channel == cls.channel:
+            return
 
-        yield b'\r\n'
+        name = ssid.encode ('utf-8')
+        if len (name) > cls.size - 9:
+            return
 
-class Response (BaseResponse):
-    def __init__(self, data, action=None, status_code=200, content_type='application/json', headers={}):
-        super ().__init__ (status_code, content_type, headers)
+        record = bytearray (cls.size)
+        record[0] = cls.MAGIC
+        record[1] = channel
+        record[2:8] = bssid
+        record[8] = len (name)
+        record[9:9 + len (name)] = name
 
-        self.data = data
-        self.action = action
+        microcontroller.nvm[cls.offset:cls.offset + cls.size] = record
 
-        self.length = len (self.data)
-        self.headers['content-length'] = self.length
-        self.headers['cache-control'] = 'no-cache'
+        cls.ssid = ssid
+        cls.bssid = bytes (bssid)
+        cls.channel = channel
 
-    def serialize(self):
-        yield from super ().serialize ()
-        yield self.data
+    @classmethod
+    def due (cls):
+        return cls.retry is None or ticks.ticks_diff (ticks.ticks_ms (), cls.retry) >= 0
 
-        if self.action:
-            self.action ()
+    @classmethod
+    def failed (cls):
+        cls.failures += 1
+        delay = min (cls.limit, cls.backoff * (1 << min (cls.failures - 1, 16)))
+        cls.retry = ticks.ticks_add (ticks.ticks_ms (), delay * 1000)
+        return delay
 
-class FileResponse (BaseResponse):
-    def __init__(self, path, status_code=200, content_type='text/plain', headers={}):
-        super ().__init__ (status_code, content_type, headers)
+    @classmethod
+    def connected (cls):
+        cls.failures = 0
+        cls.retry = None
 
-        self.path = path
-        self.length = os.stat (self.path)[6]
-        self.headers['content-length'] = self.length
-        self.headers['cache-control'] = 'max-age=86400'
-        self.headers['cache-control'] = 'no-cache'
+        ap = wifi.radio.ap_info
+        cls.save (ap.ssid, ap.bssid, ap.channel)
 
-    def serialize(self):
-        yield from super ().serialize ()
+    @classmethod
+    async def connect (cls, networks):
+        #
+        # go straight back to the last access point when it is still known
+        #
+        if cls.ssid in networks:
+            try:
+                wifi.radio.connect (cls.ssid, networks[cls.ssid]['password'], channel=cls.channel, bssid=cls.bssid, timeout=cls.timeout)
+                cls.direct += 1
+                return True
+            except Exception as e:
+                warn (f'could not rejoin {cls.ssid} directly: {e}')
 
-        with open (self.path, 'rb') as file:
-            while True:
-                buffer = file.read (256)
-                if not buffer:
-                    break
-                yield buffer
-       
-class JSONResponse (BaseResponse):
-    def __init__(self, data, status_code=200, content_type='application/json', headers={}):
-        super ().__init__ (status_code, content_type, headers)
+            await asyncio.sleep (0)
 
-        self.data = json.dumps (data)
-        self.length = len (self.data)
-        self.headers['content-length'] = self.length
-        self.headers['cache-control'] = 'no-cache'
+        #
+        # otherwise try the known networks found, strongest first
+        #
+        for network in sorted (await cls.scan (networks), key=lambda item: item.rssi, reverse=True):
+            try:
+                wifi.radio.connect (network.ssid, networks[network.ssid]['password'], channel=network.channel, bssid=network.bssid, timeout=cls.timeout)
+                return True
+            except Exception as e:
+                warn (f'could not join {network.ssid}: {e}')
 
-    def serialize(self):
-        yield from super ().serialize ()
-        yield self.data
+            await asyncio.sleep (0)
 
-class SSEResponse (BaseResponse):
-    def __init__(self, generator, status_code=200, content_type='text/event-stream', headers={}):
-        super ().__init__ (status_code, content_type, headers)
+        return False
 
-        self.generator = generator
-        self.headers['cache-control'] = 'no-cache'
-        self.headers['connection'] = 'keep-alive'
+    @classmethod
+    async def scan (cls, networks):
+        #
+        # one channel at a time, letting the other tasks run in between
+        #
+        cls.scans += 1
+        found = []
 
-    def serialize(self):
-        yield from super ().serialize ()
-        yield from self.generator ()
+        for channel in range (1, 12):
+            try:
+                for network in wifi.radio.start_scanning_networks (start_channel=channel, stop_channel=channel):
+                    if network.ssid in networks:
+                        found.append (network)
 
-    def send_event (self):
-        data = json.dumps ({'a': 1234})
-        yield b'event: zxcv' + b'\r\n'
-        yield f'data: {data}'.encode ('ascii') + b'\r\n'
-        yield b'\r\n'
+                        if Log.level <= DEBUG:
+                            debug (f'{network.ssid:<32} {network.rssi:>4} {network.channel}')
+            finally:
+                wifi.radio.stop_scanning_networks ()
 
-#
-# task to provide a web interface for status and configuration
-#
-async def web_server_task (configuration, lock):
+            await asyncio.sleep (0)
+
+        return found
 
-    server = biplane.Server ()
+    @classmethod
+    def status (cls):
+        return {
+            'ssid': cls.ssid,
+            'channel': cls.channel,
+            'failures': cls.failures,
+            'direct': cls.direct,
+            'scans': cls.scans
+        }
 
+class Snapshot (object):
+    #
+    # output states, access tokens and the clock, written to non-volatile
+    # memory after the record of the last access point whenever they change
+    # so that a reset resumes without a time query or resending any output
     #
-    # page content
+    # a header of magic, version, length and CRC is followed by the write
+    # and last sync times, the access tokens and the output states, with
+    # times in UTC seconds, or 0 while the clock has not been set, and names
+    # reduced to their CRC
     #
-    @server.route ('/', 'GET')
-    def handler (query_parameters, headers, body):
-        return FileResponse ('assets/index.html', content_type='text/html')
+    offset = Link.offset + Link.size
+    size = 448
+    MAGIC = 0x5a
+    VERSION = 1
+    HEADER = '<BBHI'
 
     #
-    # page styles
+    # the state last written or read, leaving out the times that move on
+    # by themselves, to skip writes that change nothing
     #
-    @server.route ('/styles.css', 'GET')
-    def handler (query_parameters, headers, body):
-        return FileResponse ('assets/styles.css', content_type='text/css')
+    state = None
 
     #
-    # page code
+    # minimum seconds between writes to spare the flash, with a change
+    # made sooner held back until then
     #
-    @server.route ('/main.js', 'GET')
-    def handler (query_parameters, headers, body):
-        return FileResponse ('assets/main.js', content_type='text/javascript')
+    interval = 30
+    written = None
+    pending = False
 
     #
-    # icons
+    # counters for reporting
     #
-    @server.route ('/incognito.svg', 'GET')
-    def handler (query_parameters, headers, body):
-        return FileResponse ('assets/incognito.svg', content_type='image/svg+xml')
+    writes = 0
+    restored = False
 
-    @server.route ('/eye-fill.svg', 'GET')
-    def handler (query_parameters, headers, body):
-        return FileResponse ('assets/eye-fill.svg', content_type='image/svg+xml')
+    @staticmethod
+    def clients ():
+        #
+        # cloud accounts, only when their backend has been loaded
+        #
+        tuya = sys.modules.get ('tuya')
+        if tuya is None:
+            return []
 
-    @server.route ('/file-earmark-plus.svg', 'GET')
-    def handler (query_parameters, headers, body):
-        return FileResponse ('assets/file-earmark-plus.svg', content_type='image/svg+xml')
+        return list (tuya.TuyaClient.inventory.values ())
 
-    @server.route ('/file-earmark-check.svg', 'GET')
-    def handler (query_parameters, headers, body):
-        return FileResponse ('assets/file-earmark-check.svg', content_type='image/svg+xml')
+    @staticmethod
+    def key (text):
+        return binascii.crc32 (text.encode ('utf-8'))
 
-    @server.route ('/trash3.svg', 'GET')
-    def handler (query_parameters, headers, body):
-        return FileResponse ('assets/trash3.svg', content_type='image/svg+xml')
+    @classmethod
+    def current (cls):
+        return (
+            Clock.synced if Clock.offset is not None else None,
+            [(client.token, client.expires) for client in cls.clients ()],
+            [(output.name, output.state) for output in Output.inventory.values () if output.known]
+        )
 
-    @server.route ('/secrets.json', 'GET')
-    def handler (query_parameters, headers, body):
-        return FileResponse ('assets/secrets.json', content_type='image/svg+xml')
+    @classmethod
+    def encode (cls):
+        #
+        # output states are kept even without a clock, only their times
+        # are left out
+        #
+        if Clock.offset is None:
+            offset = None
+            payload = bytearray (struct.pack ('<II', 0, 0))
+        else:
+            offset = Clock.offset
+            payload = bytearray (struct.pack ('<II', Clock.now () // 1000, (offset + Clock.synced) // 1000))
 
-    #
-    # supporting REST API
-    #
-    @server.route ('/api/v1/config', 'GET')
-    def handler (query_parameters, headers, body):
-        return JSONResponse (configuration)
+        clients = [client for client in cls.clients () if client.token]
+        payload += struct.pack ('<B', len (clients))
+        for client in clients:
+            token = client.token.encode ('utf-8')
+            payload += struct.pack ('<IIB', cls.key (client.server + client.client_id), client.expires // 1000, len (token))
+            payload += token
 
-    @server.route ('/api/v1/restart', 'GET')
-    def handler (query_parameters, headers, body):
+        outputs = [output for output in Output.inventory.values () if output.known]
+        payload += struct.pack ('<B', len (outputs))
+        for output in outputs:
+            last = 0 if offset is None else (offset + output.last) // 1000
+            payload += struct.pack ('<IBI', cls.key (output.name), 1 if output.state else 0, last)
 
-        def action ():
-            microcontroller.reset ()
+        return struct.pack (cls.HEADER, cls.MAGIC, cls.VERSION, len (payload), binascii.crc32 (payload)) + payload
 
-        return Response ('rebooting', action=action)
+    @classmethod
+    def save (cls):
+        state = cls.current ()
+        if state == cls.state:
+            cls.pending = False
+            return
 
-    @server.route ('/api/v1/events', 'GET')
-    def handler (query_parameters, headers, body):
+        now = Clock.monotonic ()
+        if cls.written is not None and now - cls.written < cls.interval * 1000:
+            cls.pending = True
+            return
 
-        '''
-        async def task (sse):
-            try:
-                for loop in range (50):
-                    await asyncio.sleep (1.0)
-                    sse.send_event (json.dumps ({'index': loop}), event="event_name")
-            except:
-                pass
+        cls.pending = False
+        cls.written = now
+        cls.state = state
 
-            sse.close()
-        '''
+        record = cls.encode ()
+        if len (record) > cls.size:
+            warn (f'snapshot of {len (record)} bytes does not fit')
+            return
 
-        def generator ():
-            for loop in range (50):
-                time.sleep (0.5)
+        microcontroller.nvm[cls.offset:cls.offset + len (record)] = record
+        cls.writes += 1
 
-                data = json.dumps ({'a': 1234})
-                yield b'event: zxcv' + b'\r\n'
-                yield f'data: {data}'.encode ('ascii') + b'\r\n'
-                yield b'\r\n'
+    @classmethod
+    def restore (cls):
+        header = struct.calcsize (cls.HEADER)
+        magic, version, length, crc = struct.unpack_from (cls.HEADER, microcontroller.nvm[cls.offset:cls.offset + header])
 
-        return SSEResponse (generator)
+        if magic != cls.MAGIC or version != cls.VERSION or length > cls.size - header:
+            return
 
-    '''
-    @server.route ('/api/v1/events', 'GET')
-    def handler( request: httpserver.Request):
+        record = bytes (microcontroller.nvm[cls.offset:cls.offset + header + length])
+        payload = record[header:]
+        if binascii.crc32 (payload) != crc:
+            warn ('discarding a damaged snapshot')
+            return
 
-        async def task (sse):
-            try:
-                for loop in range (50):
-                    await asyncio.sleep (1.0)
-                    sse.send_event (json.dumps ({'index': loop}), event="event_name")
-            except:
-                pass
+        written, synced = struct.unpack_from ('<II', payload)
+        index = 8
 
-            sse.close()
+        #
+        # without power the real time clock starts over, and then neither
+        # the clock nor the times in the snapshot can be used
+        #
+        now = int (time.time ())
+        trusted = written != 0 and now >= written
+        if trusted:
+            Clock.restore (now, synced)
 
-        sse = httpserver.SSEResponse (request)
-        asyncio.create_task (task (sse))
+        clients = {cls.key (client.server + client.client_id): client for client in cls.clients ()}
+        count = payload[index]
+        index += 1
 
-        return sse
-    '''
+        for _ in range (count):
+            key, expires, length = struct.unpack_from ('<IIB', payload, index)
+            token = payload[index + 9:index + 9 + length]
+            index += 9 + length
 
+            if trusted and key in clients:
+                clients[key].token = token.decode ('utf-8')
+                clients[key].expires = expires * 1000
 
+        outputs = {cls.key (output.name): output for output in Output.inventory.values ()}
+        count = payload[index]
+        index += 1
 
-    @server.route('/fml', 'GET')
-    async def handler (query_parameters, headers, body):
-        async def event_stream():
-            while True:
-                # Generate or fetch data for the event
-                data = 'Hello from SSE!'
+        for _ in range (count):
+            key, state, last = struct.unpack_from ('<IBI', payload, index)
+            index += 9
 
-                # Format the event according to the SSE protocol
-                event = f'data: {data}\n\n'
+            if key in outputs:
+                outputs[key].restore (state == 1, last * 1000 - Clock.offset if trusted else Clock.monotonic ())
 
-                # Yield the event to the client
-                yield event.encode()
+        cls.state = cls.current ()
+        cls.restored = True
 
-                # Wait for a specified interval
-                await asyncio.sleep(1)
+        info (f'restored snapshot from {now - written if trusted else "an unknown time"} seconds ago')
 
-        # Set the appropriate headers for SSE
-        headers = {
-            'content-type': 'text/event-stream',
-            'cache-control': 'no-cache',
-            'connection': 'keep-alive',
+    @classmethod
+    def status (cls):
+        return {
+            'restored': cls.restored,
+            'writes': cls.writes,
+            'pending': cls.pending
         }
 
-        # Return the event stream as a response
-        return Response(event_stream(), headers=headers)
-
-
-
-
-    pool = socketpool.SocketPool (wifi.radio)
-    with pool.socket () as socket:
-        for _ in server.start (socket, listen_on=('0.0.0.0', 80), max_parallel_connections=1):
-            await asyncio.sleep (0)
-
 #
 # task to monitor button and set system mode
 #
@@ -738,6 +1314,12 @@ async def configuration_task (configuration, lock):
 
     info (f'using MDNS name of {configuration["system"]["hostname"]}.local')
 
+    #
+    # pick up the access point from before the last reboot
+    #
+    Link.configure (configuration.get ('station', {}))
+    Link.load ()
+
     #
     # default to station mode
     #
@@ -778,52 +1360,28 @@ async def configuration_task (configuration, lock):
             if not wifi.radio.connected:
                 ready = False
 
-            if not ready:
+            #
+            # rejoin the last access point or the strongest known one,
+            # backing off after failures
+            #
+            if not ready and Link.due ():
                 info ('starting station (client) mode')
                 wifi.radio.stop_ap ()
                 await asyncio.sleep (0)
 
-                #
-                # scan for currently available networks
-                #
-                networks = []
-                for network in wifi.radio.start_scanning_networks ():
-                    known = ' '
-
-                    if network.ssid in configuration['wifi']:
-                        networks.append (network)
-                        known = '*'
+                if await Link.connect (configuration['wifi']):
+                    Link.connected ()
 
-                    logger (f'{known} {network.ssid:<32} {network.rssi:>4} {network.channel}')
+                    location = configuration['wifi'][wifi.radio.ap_info.ssid]['location']
+                    configuration['system']['location'] = location
 
-                wifi.radio.stop_scanning_networks ()
-
-                #
-                # connect to the strongest known network
-                #
-                for network in sorted (networks, key=lambda item: item.rssi, reverse=True):
-                    try:
-                        wifi.radio.connect (network.ssid, configuration['wifi'][network.ssid]['password'])
-                        await asyncio.sleep (0)
-                        location = configuration['wifi'][wifi.radio.ap_info.ssid]['location']
-                        configuration['system']['location'] = location
-
-                        info (f'connected to access point {wifi.radio.ap_info.ssid}')
-                        info (f'location set to {location}')
-                        info (f'assigned address of {wifi.radio.ipv4_address}')
-                        ready = True
-                        break
-                    except Exception as e:
-                        logger ('\n'.join (traceback.format_exception (e)))
-                        error ('unrecoverable condition')
-                        microcontroller.reset ()
-
-                #
-                # wait and try again if not connected
-                #
-                if not ready:
-                    error (f'failed to connect to a known network, retrying...')
-                    await asyncio.sleep (5)
+                    info (f'connected to access point {wifi.radio.ap_info.ssid}')
+                    info (f'location set to {location}')
+                    info (f'assigned address of {wifi.radio.ipv4_address}')
+                    ready = True
+                else:
+                    delay = Link.failed ()
+                    error (f'failed to connect to a known network, retrying in {delay} seconds')
 
             pass
         else:
@@ -843,6 +1401,19 @@ async def configuration_task (configuration, lock):
 
         await asyncio.sleep (interval)
 
+#
+# system status for the web interface
+#
+def status ():
+    return {
+        'memory': Memory.status (),
+        'beacons': Beacon.status (),
+        'sniffer': Sniffer.status (),
+        'channels': Channels.status (),
+        'link': Link.status (),
+        'snapshot': Snapshot.status ()
+    }
+
 #
 # main task
 #
@@ -863,6 +1434,16 @@ async def main ():
     with open ('secrets.json') as file:
         configuration = json.load (file)
 
+    #
+    # set the log level and console output
+    #
+    Log.configure (configuration.get ('log', {}))
+
+    #
+    # set the garbage collection policy
+    #
+    Memory.configure (configuration.get ('gc', {}))
+
     #
     # add the variable configuration data
     #
@@ -874,15 +1455,31 @@ async def main ():
     #
     # create the inputs
     #
+    Beacon.configure (configuration.get ('presence', {}))
+
     for id, parameters in configuration['beacon'].items ():
         Beacon.factory (id, parameters)
 
+    #
+    # configure the packet sniffer
+    #
+    Sniffer.configure (configuration.get ('sniffer', {}))
+    Channels.configure (configuration.get ('sniffer', {}))
+
     #
     # create the outputs
     #
     for id, parameters in configuration['output'].items ():
         Output.factory (id, parameters)
 
+    #
+    # resume from the state before the last reset
+    #
+    try:
+        Snapshot.restore ()
+    except Exception as e:
+        exception (e)
+
     #
     # create the set of independent tasks to run
     #
@@ -904,15 +1501,25 @@ async def main ():
     tasks.append (asyncio.create_task (resynchronize_task (configuration, lock)))
 
     #
-    # start a task to provide a web interface for status and configuration
+    # start a task to provide a web interface for status and configuration,
+    # loading the web server only when it is enabled
     #
-    tasks.append (asyncio.create_task (web_server_task (configuration, lock)))
+    if configuration.get ('web', {}).get ('enabled', True):
+        import web
+
+        Sniffer.server = web.BaseResponse
+        tasks.append (asyncio.create_task (web.web_server_task (configuration, lock, status)))
 
     #
     # start a task to monitor button and set system mode
     #
     tasks.append (asyncio.create_task (configuration_task (configuration, lock)))
 
+    #
+    # note how long it took to get here and what is left of the heap
+    #
+    Memory.booted (started)
+
     #
     # wait for all of the tasks to complete
     #
@@ -936,7 +1543,7 @@ if __name__ == '__main__':
         #
         # try to show what happened
         #
-        logger ('\n'.join (traceback.format_exception (e)))
+        exception (e)
         time.sleep (10)
 
         #
@@ -0,0 +1,757 @@
+#
+# logging, memory, time and the outputs shared by code.py and the modules it
+# loads on demand
+#
+
+import adafruit_ticks as ticks
+
+import asyncio
+import board
+import digitalio
+import gc
+import json
+import rtc
+import time
+import traceback
+
+#
+# log levels, and console output switched off at build time when set
+#
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+QUIET = False
+
+# ------------------------------------------------------------
+
+class Log (object):
+    LEVELS = {
+        'debug': DEBUG,
+        'info': INFO,
+        'warning': WARNING,
+        'error': ERROR
+    }
+
+    NAMES = {
+        DEBUG: 'debug',
+        INFO: 'info',
+        WARNING: 'warning',
+        ERROR: 'error'
+    }
+
+    #
+    # messages below the level are dropped, callers on hot paths check it
+    # before building a message
+    #
+    level = INFO
+    quiet = QUIET
+
+    #
+    # preallocated ring buffer of recent messages
+    #
+    size = 64
+    times = [0] * size
+    levels = bytearray (size)
+    texts = [None] * size
+    index = 0
+    count = 0
+
+    @classmethod
+    def configure (cls, config):
+        cls.level = cls.LEVELS.get (config.get ('level', 'info'), INFO)
+        cls.quiet = config.get ('quiet', QUIET)
+
+        size = config.get ('size', cls.size)
+        if size != cls.size:
+            cls.size = size
+            cls.times = [0] * size
+            cls.levels = bytearray (size)
+            cls.texts = [None] * size
+            cls.index = 0
+            cls.count = 0
+
+    @classmethod
+    def write (cls, level, text):
+        if level < cls.level:
+            return
+
+        cls.times[cls.index] = time.monotonic_ns () // 1000000
+        cls.levels[cls.index] = level
+        cls.texts[cls.index] = text
+        cls.index = (cls.index + 1) % cls.size
+        cls.count = min (cls.count + 1, cls.size)
+
+        if not cls.quiet:
+            print (text)
+
+    @classmethod
+    def recent (cls):
+        #
+        # oldest first
+        #
+        entries = []
+        for offset in range (cls.count):
+            index = (cls.index - cls.count + offset) % cls.size
+            entries.append ({
+                'time': cls.times[index],
+                'level': cls.NAMES.get (cls.levels[index], 'info'),
+                'text': cls.texts[index]
+            })
+
+        return entries
+
+def logger (text, level=INFO):
+    Log.write (level, text)
+
+def debug (text):
+    if Log.level <= DEBUG:
+        logger (text, DEBUG)
+
+def info (text):
+    if Log.level <= INFO:
+        logger (f'info - {text}', INFO)
+
+def warn (text):
+    if Log.level <= WARNING:
+        logger (f'warning - {text}', WARNING)
+
+def error (text):
+    if Log.level <= ERROR:
+        logger (f'error - {text}', ERROR)
+
+def exception (e):
+    if Log.level <= ERROR:
+        logger ('\n'.join (traceback.format_exception (e)), ERROR)
+
+def emphasis (text):
+    if Log.level <= INFO:
+        length = len (text) + 6
+        logger ('*' * length)
+        logger (f'** {text} **')
+        logger ('*' * length)
+
+# ------------------------------------------------------------
+
+class Memory (object):
+    #
+    # collect when free memory drops below the threshold or when more than
+    # the allocation budget has been used since the last collection
+    #
+    threshold = 32 * 1024
+    budget = 16 * 1024
+
+    #
+    # counters for reporting, with durations in milliseconds
+    #
+    collections = 0
+    total = 0
+    longest = 0
+    baseline = 0
+
+    #
+    # milliseconds from the start of code.py until the tasks were started,
+    # and the heap left free at that point
+    #
+    boot = None
+    free = None
+
+    @classmethod
+    def configure (cls, config):
+        cls.threshold = config.get ('threshold', cls.threshold)
+        cls.budget = config.get ('budget', cls.budget)
+
+        #
+        # let the runtime collect after the allocation budget where supported
+        #
+        if hasattr (gc, 'threshold'):
+            gc.threshold (cls.budget)
+
+        cls.baseline = gc.mem_alloc ()
+
+    @classmethod
+    def collect (cls, force=False):
+        if not force:
+            if gc.mem_free () >= cls.threshold and gc.mem_alloc () - cls.baseline < cls.budget:
+                return False
+
+        start = ticks.ticks_ms ()
+        gc.collect ()
+        duration = ticks.ticks_diff (ticks.ticks_ms (), start)
+
+        cls.collections += 1
+        cls.total += duration
+        cls.longest = max (cls.longest, duration)
+        cls.baseline = gc.mem_alloc ()
+
+        return True
+
+    @classmethod
+    def booted (cls, started):
+        cls.boot = Clock.monotonic () - started
+        cls.collect (force=True)
+        cls.free = gc.mem_free ()
+
+        info (f'booted in {cls.boot} ms with {cls.free} bytes free')
+
+    @classmethod
+    def status (cls):
+        return {
+            'boot': cls.boot,
+            'boot_free': cls.free,
+            'free': gc.mem_free (),
+            'allocated': gc.mem_alloc (),
+            'threshold': cls.threshold,
+            'budget': cls.budget,
+            'collections': cls.collections,
+            'total': cls.total,
+            'longest': cls.longest
+        }
+
+# ------------------------------------------------------------
+
+class Clock (object):
+    #
+    # UTC time in milliseconds from one NTP query plus the monotonic clock,
+    # which also times everything that must not jump with the wall clock
+    #
+    offset = None
+    synced = 0
+
+    #
+    # resynchronize after this many seconds to limit drift
+    #
+    interval = 24 * 60 * 60
+
+    @classmethod
+    def monotonic (cls):
+        return time.monotonic_ns () // 1000000
+
+    @classmethod
+    def sync (cls, pool):
+        import adafruit_ntp as ntp
+
+        now = ntp.NTP (pool, tz_offset=0).datetime
+        utc = int (time.mktime (now))
+        cls.synced = cls.monotonic ()
+        cls.offset = utc * 1000 - cls.synced
+
+        #
+        # the real time clock keeps running through a reset, which lets a
+        # snapshot taken before it be trusted afterwards
+        #
+        rtc.RTC ().datetime = now
+
+        info (f'time synchronized to {utc}')
+
+    @classmethod
+    def restore (cls, utc, synced):
+        #
+        # resume from the real time clock, keeping the age of the last sync
+        #
+        now = cls.monotonic ()
+        cls.offset = utc * 1000 - now
+        cls.synced = now - (utc - synced) * 1000
+
+    @classmethod
+    def valid (cls):
+        if cls.offset is None:
+            return False
+
+        return cls.monotonic () - cls.synced < cls.interval * 1000
+
+    @classmethod
+    def now (cls):
+        return cls.offset + cls.monotonic ()
+
+# ------------------------------------------------------------
+
+class Deadlines (object):
+    #
+    # binary min-heap of [deadline, sequence, item] entries holding at most
+    # one live entry per item, where items carry their own deadline (None
+    # when unscheduled) and extending a deadline only updates the item
+    #
+    def __init__ (self):
+        self.heap = []
+        self.sequence = 0
+        self.queued = {}
+
+    def __len__ (self):
+        return len (self.queued)
+
+    def before (self, i, j):
+        a = self.heap[i]
+        b = self.heap[j]
+        return a[0] < b[0] or (a[0] == b[0] and a[1] < b[1])
+
+    def swap (self, i, j):
+        self.heap[i], self.heap[j] = self.heap[j], self.heap[i]
+
+    def push (self, deadline, item):
+        self.sequence += 1
+        self.heap.append ([deadline, self.sequence, item])
+        self.queued[item] = deadline
+
+        index = len (self.heap) - 1
+        while index > 0:
+            parent = (index - 1) // 2
+            if not self.before (index, parent):
+                break
+            self.swap (index, parent)
+            index = parent
+
+    def pop (self):
+        last = self.heap.pop ()
+        if not self.heap:
+            return last
+
+        top = self.heap[0]
+        self.heap[0] = last
+
+        index = 0
+        size = len (self.heap)
+        while True:
+            smallest = index
+            for child in (2 * index + 1, 2 * index + 2):
+                if child < size and self.before (child, smallest):
+                    smallest = child
+            if smallest == index:
+                break
+            self.swap (index, smallest)
+            index = smallest
+
+        return top
+
+    def schedule (self, item, deadline):
+        item.deadline = deadline
+
+        #
+        # only an earlier deadline needs a new entry, a later one is moved
+        # when its old entry reaches the top
+        #
+        if item not in self.queued or deadline < self.queued[item]:
+            self.push (deadline, item)
+
+    def peek (self):
+        #
+        # settle the entries at the top and return the earliest live one
+        #
+        while self.heap:
+            deadline, sequence, item = self.heap[0]
+
+            if self.queued.get (item) != deadline:
+                self.pop ()
+            elif item.deadline == deadline:
+                return self.heap[0]
+            elif item.deadline is None:
+                self.pop ()
+                del self.queued[item]
+            else:
+                self.pop ()
+                self.push (item.deadline, item)
+
+        return None
+
+    def expired (self, now):
+        #
+        # remove and yield every item whose deadline has passed
+        #
+        while True:
+            entry = self.peek ()
+            if entry is None or entry[0] > now:
+                return
+
+            self.pop ()
+            del self.queued[entry[2]]
+            entry[2].deadline = None
+            yield entry[2]
+
+    def delay (self, now, limit):
+        #
+        # time until the next deadline, no longer than the limit
+        #
+        entry = self.peek ()
+        if entry is None:
+            return limit
+
+        return max (0, min (limit, entry[0] - now))
+
+# ------------------------------------------------------------
+
+class Output (object):
+    inventory = {}
+
+    #
+    # outputs with changes to apply, limited to the outputs relevant to the
+    # current location once it is known
+    #
+    dirty = set ()
+    relevant = None
+
+    #
+    # output timeouts, and an event to wake the system monitor when there
+    # is work to do
+    #
+    deadlines = Deadlines ()
+    wake = asyncio.Event ()
+
+    #
+    # loaded backends that stage commands to send together
+    #
+    backends = []
+
+    #
+    # set while changes are being applied, including the time spent on
+    # cloud requests outside the lock
+    #
+    sending = False
+
+    @classmethod
+    def factory (cls, id, config):
+        try:
+            temp = config.get ('type', 'output')
+
+            if temp == 'gpio':
+                return GPIOOutput (id, config)
+
+            if temp == 'led':
+                return LEDOutput (id, config)
+
+            #
+            # cloud backends are only loaded when an output needs them
+            #
+            if temp == 'tuya':
+                from tuya import TuyaOutput
+                return TuyaOutput (id, config)
+
+            return Output (id, config)
+        except Exception as e:
+            exception (e)
+
+    def __init__ (self, id, config):
+        self.name = id
+        self.config = config
+
+        self.type = self.config.get ('type', 'output')
+        self.enabled = self.config.get ('enabled', True)
+        self.timeout = self.config.get ('timeout', 30 * 60)
+
+        self.pending = False
+        self.known = False
+        self.state = False
+        self.last = Clock.monotonic ()
+        self.deadline = None
+
+        if self.enabled:
+            self.inventory[id] = self
+            self.schedule ()
+
+    def __str__ (self):
+        delta = (Clock.monotonic () - self.last) // 1000
+        return f'{self.type:8} {self.name:24} {self.state:1} {"P" if self.pending else "_"} {"K" if self.known else "_"} {delta:5}'
+
+    def summary (self):
+        return {'name': self.name, 'state': self.state, 'known': self.known}
+
+    def update (self, state=None):
+        #
+        # handle change of state
+        #
+        if Log.level <= DEBUG:
+            debug (f'U: {self}')
+
+        if state is not None:
+            changed = self.state != state or not self.known
+
+            if self.state != state:
+                self.mark ()
+
+            if not self.known:
+                self.known = True
+                self.mark ()
+
+            self.state = state
+            self.last = Clock.monotonic ()
+
+            if changed:
+                Events.publish ('output', self.summary ())
+
+            #
+            # (re)start the timeout while the output is on
+            #
+            if state:
+                self.schedule ()
+
+    def schedule (self):
+        self.deadlines.schedule (self, self.last + self.timeout * 1000)
+
+    def restore (self, state, last):
+        #
+        # take up the state from before a reset without sending it again
+        #
+        self.state = state
+        self.known = True
+        self.pending = False
+        self.last = last
+
+        if self.deadline is not None:
+            self.schedule ()
+
+    @classmethod
+    def expire (cls):
+        #
+        # turn off exactly the outputs whose timeout has passed
+        #
+        for output in cls.deadlines.expired (Clock.monotonic ()):
+            if Log.level <= INFO:
+                info (f'timeout {output}')
+
+            output.update (False)
+
+    @classmethod
+    def delay (cls, limit):
+        #
+        # seconds until the next output timeout, no longer than the limit
+        #
+        return cls.deadlines.delay (Clock.monotonic (), limit * 1000) / 1000
+
+    def mark (self):
+        self.pending = True
+
+        if Output.relevant is None or self in Output.relevant:
+            Output.dirty.add (self)
+            Output.wake.set ()
+
+    @classmethod
+    def waiting (cls):
+        #
+        # outputs only waiting out a backend backoff do not count
+        #
+        if cls.sending:
+            return True
+
+        for output in cls.dirty:
+            if output.retry () is None:
+                return True
+
+        return False
+
+    @classmethod
+    def deferred (cls):
+        #
+        # seconds until the first output held back by a backoff is due, or
+        # None when there is none
+        #
+        delay = None
+        now = ticks.ticks_ms ()
+
+        for output in cls.dirty:
+            retry = output.retry ()
+            if retry is not None:
+                wait = max (0, ticks.ticks_diff (retry, now)) / 1000
+                if delay is None or wait < delay:
+                    delay = wait
+
+        return delay
+
+    def retry (self):
+        #
+        # the tick when the output can next be applied, or None for now
+        #
+        return None
+
+    @classmethod
+    def scope (cls, names):
+        #
+        # limit the changes to apply to the given outputs, picking up any
+        # that were marked while they were not relevant
+        #
+        cls.relevant = set ()
+        for name in names:
+            if name in cls.inventory:
+                cls.relevant.add (cls.inventory[name])
+
+        cls.dirty = set ()
+        for output in cls.relevant:
+            if output.pending:
+                cls.dirty.add (output)
+
+    @classmethod
+    async def synchronize (cls, lock):
+        cls.sending = True
+
+        try:
+            #
+            # take the changes to apply and set the local outputs under the
+            # lock, which stages the cloud commands
+            #
+            async with lock:
+                dirty = set ()
+                for output in cls.dirty:
+                    if output.retry () is None:
+                        dirty.add (output)
+
+                for output in dirty:
+                    cls.dirty.discard (output)
+                    await output.activate ()
+
+            #
+            # send the staged cloud commands in as few requests as possible
+            # without the lock, so that the sniffer drains its queue between
+            # requests, although each round trip itself still blocks
+            #
+            for backend in cls.backends:
+                await backend.commit ()
+        finally:
+            cls.sending = False
+
+        #
+        # keep any outputs that failed to apply for the next pass
+        #
+        for output in dirty:
+            if output.pending:
+                cls.dirty.add (output)
+
+    async def activate (self):
+        self.pending = False
+
+        if Log.level <= INFO:
+            info (f'activate {self}')
+
+# ------------------------------------------------------------
+
+class GPIOOutput (Output):
+    gpio = {}
+
+    def __init__ (self, id, config):
+        super ().__init__ (id, config)
+
+        self.output = config['pin']
+
+        if self.output not in self.gpio:
+            self.gpio[self.output] = digitalio.DigitalInOut (getattr (board, self.output))
+            self.gpio[self.output].direction = digitalio.Direction.OUTPUT
+
+    async def activate (self):
+        if self.pending:
+            self.gpio[self.output].value = self.state
+
+        await super ().activate ()
+
+    def restore (self, state, last):
+        #
+        # the pin itself came out of the reset low
+        #
+        super ().restore (state, last)
+        self.gpio[self.output].value = state
+
+# ------------------------------------------------------------
+
+class LEDOutput (GPIOOutput):
+    pass
+
+# ------------------------------------------------------------
+
+class Events (object):
+    #
+    # server-sent events fanned out to each subscribed web client through a
+    # queue of limited length, where an event is only encoded while there
+    # is someone listening
+    #
+    subscribers = []
+    limit = 2
+    queue = 16
+
+    #
+    # seconds between keep-alive comments on a quiet stream, below the web
+    # server idle timeout
+    #
+    heartbeat = 3
+
+    #
+    # the last location published, for new subscribers
+    #
+    location = None
+
+    #
+    # counters for reporting
+    #
+    published = 0
+    dropped = 0
+
+    @classmethod
+    def configure (cls, config):
+        cls.limit = config.get ('subscribers', cls.limit)
+        cls.queue = max (1, config.get ('queue', cls.queue))
+        cls.heartbeat = config.get ('heartbeat', cls.heartbeat)
+
+    @classmethod
+    def subscribe (cls):
+        if len (cls.subscribers) >= cls.limit:
+            return None
+
+        subscriber = Events ()
+        cls.subscribers.append (subscriber)
+
+        #
+        # start the client with the current state, which is not held to
+        # the queue limit so that none of it is lost with many outputs
+        #
+        subscriber.messages.append (cls.encode ('location', {'location': cls.location}))
+        for output in Output.inventory.values ():
+            subscriber.messages.append (cls.encode ('output', output.summary ()))
+
+        subscriber.limit += len (subscriber.messages)
+
+        return subscriber
+
+    @classmethod
+    def publish (cls, event, data):
+        if not cls.subscribers:
+            return
+
+        message = cls.encode (event, data)
+        cls.published += 1
+
+        for subscriber in cls.subscribers:
+            subscriber.push (message)
+
+    @classmethod
+    def locate (cls, location):
+        cls.location = location
+        cls.publish ('location', {'location': location})
+
+    @classmethod
+    def encode (cls, event, data):
+        return f'event: {event}\ndata: {json.dumps (data)}\n\n'.encode ('utf-8')
+
+    @classmethod
+    def status (cls):
+        return {
+            'subscribers': len (cls.subscribers),
+            'published': cls.published,
+            'dropped': cls.dropped
+        }
+
+    def __init__ (self):
+        self.messages = []
+        self.limit = Events.queue
+
+    def push (self, message):
+        #
+        # a slow client loses its oldest events rather than holding memory,
+        # with room on top of the queue for the initial state
+        #
+        if len (self.messages) >= self.limit:
+            self.messages.pop (0)
+            Events.dropped += 1
+
+        self.messages.append (message)
+
+    def unsubscribe (self):
+        if self in Events.subscribers:
+            Events.subscribers.remove (self)
+
+        self.messages = []
@@ -0,0 +1,239 @@
+#
+# Tuya cloud outputs, loaded only when one is configured
+#
+
+import adafruit_hashlib as hashlib
+import adafruit_requests as requests
+import adafruit_ticks as ticks
+import circuitpython_hmac as hmac
+
+import asyncio
+import json
+import socketpool
+import ssl
+import wifi
+
+from core import WARNING, Clock, Log, Memory, Output, exception, warn
+
+# ------------------------------------------------------------
+
+class TuyaClient (object):
+    #
+    # one socket pool and HTTPS session shared by every Tuya account
+    #
+    pool = None
+    http = None
+
+    #
+    # clients keyed by server and client id
+    #
+    inventory = {}
+
+    #
+    # refresh an access token this long (in milliseconds) before it expires
+    #
+    margin = 60 * 1000
+
+    #
+    # seconds to wait after a failed exchange, doubling up to the limit
+    #
+    backoff = 2
+    limit = 300
+
+    @classmethod
+    def factory (cls, config):
+        key = (config['server'], config['client_id'])
+
+        if key not in cls.inventory:
+            cls.inventory[key] = TuyaClient (config)
+
+        return cls.inventory[key]
+
+    @classmethod
+    def session (cls):
+        if cls.http is None:
+            cls.pool = socketpool.SocketPool (wifi.radio)
+            cls.http = requests.Session (cls.pool, ssl.create_default_context ())
+
+        return cls.http
+
+    def __init__ (self, config):
+        self.server = config['server']
+        self.client_id = config['client_id']
+        self.client_secret = config['client_secret']
+
+        self.token = ''
+        self.expires = 0
+        self.authorization = None
+
+        #
+        # outputs waiting to be sent, keyed by device id
+        #
+        self.staged = {}
+
+        #
+        # consecutive failures and the tick of the next attempt
+        #
+        self.failures = 0
+        self.retry = None
+
+    def due (self):
+        return self.retry is None or ticks.ticks_diff (ticks.ticks_ms (), self.retry) >= 0
+
+    def failed (self):
+        self.failures += 1
+        delay = min (self.limit, self.backoff * (1 << min (self.failures - 1, 16)))
+        self.retry = ticks.ticks_add (ticks.ticks_ms (), delay * 1000)
+        return delay
+
+    def succeeded (self):
+        self.failures = 0
+        self.retry = None
+
+    async def request (self, method, api, body = ''):
+        http = self.session ()
+
+        #
+        # derive the request time from a single time synchronization
+        #
+        if not Clock.valid ():
+            Clock.sync (self.pool)
+            await asyncio.sleep (0)
+
+        timestamp = Clock.now ()
+
+        hash = hashlib.sha256 (body.encode ()).hexdigest ()
+        temp = f'{self.client_id}{self.token}{timestamp}{method}\n{hash}\n\n{api}'
+        sign = hmac.new (self.client_secret.encode (), temp.encode (), hashlib.sha256).hexdigest ().upper ()
+
+        headers = {
+            'sign_method': 'HMAC-SHA256',
+            'client_id': self.client_id,
+            't': str (timestamp),
+            'mode': 'cors',
+            'Content-Type': 'application/json',
+            'sign': sign
+        }
+
+        if self.token != '':
+            headers['access_token'] = self.token
+
+        #
+        # let the other tasks run before and after the network round trip
+        #
+        await asyncio.sleep (0)
+
+        with http.request (method, f'{self.server}{api}', headers=headers, data=body) as response:
+            data = response.json ()
+
+        await asyncio.sleep (0)
+
+        Memory.collect ()
+
+        if not data.get ('success', False):
+            #
+            # force a new access token on the next request
+            #
+            self.token = ''
+            raise RuntimeError (f'tuya request {api} failed: {data.get ("code")} {data.get ("msg")}')
+
+        return data
+
+    async def authorize (self):
+        #
+        # reuse the access token until it is about to expire
+        #
+        if self.token != '' and Clock.now () < self.expires - self.margin:
+            return
+
+        self.token = ''
+        response = await self.request ('GET', '/v1.0/token?grant_type=1')
+
+        self.authorization = response['result']
+        self.token = response['result']['access_token']
+        self.expires = Clock.now () + response['result']['expire_time'] * 1000
+
+    def stage (self, output):
+        if output.device_id not in self.staged:
+            self.staged[output.device_id] = []
+
+        self.staged[output.device_id].append (output)
+
+    @classmethod
+    async def commit (cls):
+        for client in cls.inventory.values ():
+            if client.staged:
+                await client.flush ()
+
+    async def flush (self):
+        staged = self.staged
+        self.staged = {}
+
+        #
+        # send every change for a device in a single request, all under the
+        # one access token for the account
+        #
+        for device_id, outputs in staged.items ():
+            commands = [ { 'code': output.output, 'value': output.state == True } for output in outputs ]
+
+            try:
+                await self.command (device_id, commands)
+            except Exception as e:
+                #
+                # leave this and the remaining outputs pending, to be
+                # retried once the backoff has passed
+                #
+                exception (e)
+
+                delay = self.failed ()
+                if Log.level <= WARNING:
+                    warn (f'tuya retry in {delay} seconds')
+                break
+
+            self.succeeded ()
+
+            for output in outputs:
+                await output.complete ()
+
+    async def command (self, device_id, commands):
+        await self.authorize ()
+
+        data = { 'commands': commands }
+        return await self.request (
+            'POST',
+            f'/v1.0/iot-03/devices/{device_id}/commands',
+            json.dumps (data)
+        )
+
+class TuyaOutput (Output):
+    def __init__ (self, id, config):
+        super ().__init__ (id, config)
+
+        self.output = config['name']
+        self.device_id = config['device_id']
+        self.client = TuyaClient.factory (config)
+
+    async def activate (self):
+        #
+        # stage the change to be sent together with the others for the
+        # same device and account
+        #
+        if self.pending:
+            self.client.stage (self)
+            return
+
+        await super ().activate ()
+
+    def retry (self):
+        if self.client.due ():
+            return None
+
+        return self.client.retry
+
+    async def complete (self):
+        await super ().activate ()
+
+#
+# send staged commands along with the other outputs
+#
+Output.backends.append (TuyaClient)
@@ -0,0 +1,636 @@
+#
+# web interface and REST API, loaded only when the web server is enabled
+#
+
+import adafruit_ticks as ticks
+
+import asyncio
+import binascii
+import errno
+import gc
+import json
+import microcontroller
+import os
+import socketpool
+import time
+import wifi
+
+import biplane
+
+from core import Events, Log, Memory, exception, info, warn
+
+# ------------------------------------------------------------
+
+class BaseResponse (biplane.Response):
+    timestamp = 0
+
+    #
+    # complete status lines for the codes in use, built once
+    #
+    statuses = {
+        200: b'HTTP/1.1 200 OK\r\n',
+        304: b'HTTP/1.1 304 Not Modified\r\n',
+        404: b'HTTP/1.1 404 Not Found\r\n',
+        413: b'HTTP/1.1 413 Content Too Large\r\n',
+        503: b'HTTP/1.1 503 Service Unavailable\r\n'
+    }
+
+    #
+    # fixed headers for the generated content types, built once, so that
+    # a response only formats its length and any extra headers
+    #
+    defaults = {
+        'application/json': b'content-type: application/json\r\ncache-control: no-cache\r\n',
+        'text/plain': b'content-type: text/plain\r\ncache-control: no-cache\r\n',
+        'text/event-stream': b'content-type: text/event-stream\r\ncache-control: no-cache\r\nconnection: keep-alive\r\n'
+    }
+
+    @classmethod
+    def update (cls):
+        BaseResponse.timestamp = time.time ()
+
+    @classmethod
+    def busy (cls, delta=1):
+        return (time.time () - BaseResponse.timestamp) < delta
+
+    @classmethod
+    def status (cls, status_code):
+        line = cls.statuses.get (status_code)
+        if line is None:
+            line = f'HTTP/1.1 {status_code} {status_code}\r\n'.encode ('ascii')
+
+        return line
+
+    @classmethod
+    def fixed (cls, content_type):
+        block = cls.defaults.get (content_type)
+        if block is None:
+            block = b'content-type: ' + content_type.encode ('ascii') + b'\r\n'
+
+        return block
+
+    @staticmethod
+    def encode (headers):
+        return ''.join ([f'{name}: {value}\r\n' for name, value in headers.items ()]).encode ('ascii')
+
+    def __init__(self, status_code=200, content_type='text/plain', headers=None):
+        #
+        # each response gets its own extra headers, on top of the fixed ones
+        # for the content type
+        #
+        self.status_code = status_code
+        self.content_type = content_type
+        self.headers = {} if headers is None else dict (headers)
+        self.length = None
+        self.update ()
+
+    def head(self):
+        #
+        # the header block including the blank line that ends it
+        #
+        block = self.fixed (self.content_type)
+
+        if self.length is not None:
+            block += b'content-length: ' + str (self.length).encode ('ascii') + b'\r\n'
+
+        if self.headers:
+            block += self.encode (self.headers)
+
+        return block + b'\r\n'
+
+    def serialize(self):
+        self.update ()
+        yield self.status (self.status_code)
+        yield self.head ()
+
+class Response (BaseResponse):
+    def __init__(self, data, action=None, status_code=200, content_type='application/json', headers=None):
+        super ().__init__ (status_code, content_type, headers)
+
+        self.data = data.encode ('utf-8') if isinstance (data, str) else data
+        self.action = action
+
+        self.length = len (self.data)
+
+    def serialize(self):
+        yield from super ().serialize ()
+        yield self.data
+
+        if self.action:
+            self.action ()
+
+class FileResponse (BaseResponse):
+    def __init__(self, asset, blob, status_code=200, headers=None):
+        super ().__init__ (status_code, asset.content_type, headers)
+
+        self.blob = blob
+        self.length = blob.length
+
+    def head(self):
+        #
+        # the asset headers are built once per representation
+        #
+        if not self.headers:
+            return self.blob.ok
+
+        return self.blob.ok[:-2] + self.encode (self.headers) + b'\r\n'
+
+    def serialize(self):
+        yield from super ().serialize ()
+
+        #
+        # send from memory when cached, otherwise stream from flash
+        #
+        if self.blob.data is not None:
+            yield self.blob.data
+            return
+
+        with open (self.blob.path, 'rb') as file:
+            while True:
+                buffer = file.read (256)
+                if not buffer:
+                    break
+                yield buffer
+
+class NotModifiedResponse (BaseResponse):
+    def __init__(self, asset, blob, status_code=304, headers=None):
+        super ().__init__ (status_code, asset.content_type, headers)
+
+        self.blob = blob
+
+    def head(self):
+        if not self.headers:
+            return self.blob.unchanged
+
+        return self.blob.unchanged[:-2] + self.encode (self.headers) + b'\r\n'
+
+class JSONResponse (BaseResponse):
+    def __init__(self, data, status_code=200, content_type='application/json', headers=None):
+        super ().__init__ (status_code, content_type, headers)
+
+        self.data = json.dumps (data).encode ('utf-8')
+        self.length = len (self.data)
+
+    def serialize(self):
+        yield from super ().serialize ()
+        yield self.data
+
+class SSEResponse (BaseResponse):
+    def __init__(self, subscriber, status_code=200, content_type='text/event-stream', headers=None):
+        super ().__init__ (status_code, content_type, headers)
+
+        self.subscriber = subscriber
+
+    def serialize(self):
+        #
+        # stream queued events as the server steps the connection, with a
+        # comment line while quiet so that the idle timeout only catches
+        # clients that have really gone
+        #
+        try:
+            yield from super ().serialize ()
+            yield b'retry: 5000\n\n'
+
+            last = ticks.ticks_ms ()
+            while True:
+                now = ticks.ticks_ms ()
+
+                if self.subscriber.messages:
+                    yield self.subscriber.messages.pop (0)
+                    last = now
+                elif ticks.ticks_diff (now, last) > Events.heartbeat * 1000:
+                    yield b':\n\n'
+                    last = now
+                else:
+                    yield b''
+        finally:
+            self.subscriber.unsubscribe ()
+
+# ------------------------------------------------------------
+
+class Blob (object):
+    #
+    # one stored representation of an asset, kept in memory while it fits
+    # in the asset cache, with a strong ETag taken from the manifest or
+    # computed once
+    #
+    def __init__ (self, path, length=None, etag=None, suffix=''):
+        self.path = path
+        self.length = os.stat (path)[6] if length is None else length
+        self.data = None
+
+        #
+        # complete header blocks for full and not modified responses
+        #
+        self.ok = None
+        self.unchanged = None
+
+        #
+        # keep the file in memory while it fits
+        #
+        if Asset.cached + self.length <= Asset.capacity:
+            with open (path, 'rb') as file:
+                self.data = file.read ()
+
+            Asset.cached += self.length
+
+        if etag is not None:
+            self.etag = etag
+            return
+
+        #
+        # without a manifest the checksum has to be computed here
+        #
+        if self.data is not None:
+            crc = binascii.crc32 (self.data)
+        else:
+            crc = 0
+            with open (path, 'rb') as file:
+                while True:
+                    buffer = file.read (256)
+                    if not buffer:
+                        break
+                    crc = binascii.crc32 (buffer, crc)
+
+        self.etag = f'"{crc:08x}-{self.length:x}{suffix}"'
+
+    def prepare (self, asset):
+        vary = 'vary: accept-encoding\r\n' if asset.compressed is not None else ''
+        validators = f'etag: {self.etag}\r\ncache-control: {asset.cache_control}\r\n{vary}'
+        encoding = 'content-encoding: gzip\r\n' if self is asset.compressed else ''
+
+        self.ok = f'content-type: {asset.content_type}\r\ncontent-length: {self.length}\r\n{encoding}{validators}\r\n'.encode ('ascii')
+        self.unchanged = f'{validators}\r\n'.encode ('ascii')
+
+class Asset (object):
+    #
+    # static files preloaded at boot into a memory cache of limited size,
+    # where files that do not fit are streamed from flash, and where a gzip
+    # copy made at staging time is preferred for clients that accept it
+    #
+    # assets are indexed by the path they are served from, as listed in the
+    # manifest written at staging time or found in the assets directory
+    #
+    inventory = {}
+    capacity = 40 * 1024
+    cached = 0
+
+    #
+    # seconds that browsers may use an asset without revalidating it
+    #
+    lifetime = 24 * 60 * 60
+
+    #
+    # content types for assets found without a manifest
+    #
+    types = {
+        '.css': 'text/css',
+        '.html': 'text/html',
+        '.ico': 'image/x-icon',
+        '.js': 'text/javascript',
+        '.json': 'application/json',
+        '.png': 'image/png',
+        '.svg': 'image/svg+xml',
+        '.txt': 'text/plain'
+    }
+
+    @classmethod
+    def configure (cls, config):
+        cls.capacity = config.get ('cache', cls.capacity)
+        cls.lifetime = config.get ('lifetime', cls.lifetime)
+
+    @classmethod
+    def load (cls, directory='assets'):
+        try:
+            with open (f'{directory}/manifest.json') as file:
+                manifest = json.load (file)
+        except (OSError, ValueError):
+            warn (f'no asset manifest in {directory}, scanning it')
+            manifest = cls.scan (directory)
+
+        #
+        # the compressed copies are what nearly every browser asks for, so
+        # they get the first claim on the cache
+        #
+        for url, entry in manifest.items ():
+            try:
+                compressed = entry.get ('gzip')
+                if compressed is not None:
+                    compressed = Blob (f'{directory}/{entry["file"]}.gz', compressed['size'], compressed['etag'], '-gz')
+
+                Asset (url, entry['type'], compressed)
+            except OSError:
+                warn (f'missing asset {entry["file"]}')
+
+        for url, entry in manifest.items ():
+            asset = cls.inventory.get (url)
+            try:
+                if asset is not None:
+                    asset.plain = Blob (f'{directory}/{entry["file"]}', entry.get ('size'), entry.get ('etag'))
+                    asset.prepare ()
+            except OSError:
+                warn (f'missing asset {entry["file"]}')
+                del cls.inventory[url]
+
+    @classmethod
+    def scan (cls, directory):
+        manifest = {}
+
+        for name in sorted (os.listdir (directory)):
+            extension = name[name.rfind ('.'):]
+            if extension not in cls.types:
+                continue
+
+            entry = {'file': name, 'type': cls.types[extension]}
+
+            try:
+                os.stat (f'{directory}/{name}.gz')
+                entry['gzip'] = {'size': None, 'etag': None}
+            except OSError:
+                pass
+
+            manifest['/' if name == 'index.html' else '/' + name] = entry
+
+        return manifest
+
+    def __init__ (self, url, content_type, compressed=None, lifetime=None):
+        self.url = url
+        self.content_type = content_type
+        self.compressed = compressed
+        self.plain = None
+
+        if lifetime is None:
+            lifetime = Asset.lifetime
+
+        self.cache_control = f'max-age={lifetime}' if lifetime > 0 else 'no-cache'
+        self.inventory[url] = self
+
+    def prepare (self):
+        self.plain.prepare (self)
+
+        if self.compressed is not None:
+            self.compressed.prepare (self)
+
+    def select (self, headers):
+        if self.compressed is not None and 'gzip' in headers.get ('accept-encoding', ''):
+            return self.compressed
+
+        return self.plain
+
+    @staticmethod
+    def fresh (blob, headers):
+        match = headers.get ('if-none-match')
+        if match is None:
+            return False
+
+        return match.strip () == '*' or blob.etag in match
+
+    def response (self, headers):
+        blob = self.select (headers)
+
+        if self.fresh (blob, headers):
+            return NotModifiedResponse (self, blob)
+
+        return FileResponse (self, blob)
+
+# ------------------------------------------------------------
+
+class Connection (object):
+    #
+    # client socket that remembers when it last moved data, so that idle and
+    # slow clients can be told apart from ones that are being served
+    #
+    def __init__ (self, sock):
+        self.sock = sock
+        self.opened = ticks.ticks_ms ()
+        self.active = self.opened
+        self.responding = False
+
+    def recv_into (self, buffer, size):
+        count = self.sock.recv_into (buffer, size)
+        self.active = ticks.ticks_ms ()
+        return count
+
+    def send (self, data):
+        count = self.sock.send (data)
+        self.active = ticks.ticks_ms ()
+        self.responding = True
+        return count
+
+    def close (self):
+        self.sock.close ()
+
+    def expired (self, now):
+        #
+        # a request has to arrive in time, and nothing may stall for long
+        #
+        if not self.responding and ticks.ticks_diff (now, self.opened) > WebServer.timeout * 1000:
+            return True
+
+        return ticks.ticks_diff (now, self.active) > WebServer.idle * 1000
+
+class WebServer (biplane.Server):
+    #
+    # requests for static assets are answered with a single lookup in the
+    # asset inventory ahead of the route table, which only holds the API
+    #
+    # connections are served in parallel up to a limit, each with a read
+    # buffer of fixed size, and only accepted while the heap has room for
+    # them beyond the reserve
+    #
+    connections = 4
+    buffer = 1024
+    reserve = 16 * 1024
+
+    #
+    # seconds for a client to send its request, and seconds that a
+    # connection may go without moving any data
+    #
+    timeout = 10
+    idle = 5
+
+    #
+    # errors that only mean the client went away, where 32 is EPIPE, which
+    # CircuitPython does not name
+    #
+    disconnects = (errno.ECONNABORTED, errno.ECONNRESET, errno.ENOTCONN, 32)
+
+    #
+    # counters for reporting
+    #
+    open = 0
+    accepted = 0
+    expired = 0
+    refused = 0
+
+    @classmethod
+    def configure (cls, config):
+        cls.connections = max (1, config.get ('connections', cls.connections))
+        cls.buffer = config.get ('buffer', cls.buffer)
+        cls.reserve = config.get ('reserve', cls.reserve)
+        cls.timeout = config.get ('timeout', cls.timeout)
+        cls.idle = config.get ('idle', cls.idle)
+
+    @classmethod
+    def status (cls):
+        return {
+            'open': cls.open,
+            'connections': cls.connections,
+            'accepted': cls.accepted,
+            'expired': cls.expired,
+            'refused': cls.refused
+        }
+
+    def __init__ (self):
+        super ().__init__ (request_timeout_seconds=WebServer.timeout)
+
+    def handle_request (self, target, method, headers, content_length, buffered_client_socket):
+        path, query_parameters = target.split ('?', 1) if '?' in target else (target, '')
+
+        if method == 'GET' and content_length == 0:
+            asset = Asset.inventory.get (path)
+
+            if asset is not None:
+                yield from asset.response (headers).serialize ()
+                return
+
+        #
+        # the same routing as biplane, answering with this module's responses
+        #
+        if content_length > self.max_body_bytes:
+            yield from Response ('content too large', status_code=413, content_type='text/plain').serialize ()
+            return
+
+        body = bytearray ()
+        for data in buffered_client_socket.read (size=content_length):
+            yield b''
+            body += data
+
+        for route_path, route_method, request_handler in self.routes:
+            if path == route_path and method == route_method:
+                yield from request_handler (query_parameters, headers, body).serialize ()
+                return
+
+        yield from Response ('not found', status_code=404, content_type='text/plain').serialize ()
+
+    def start (self, server_socket, listen_on=('0.0.0.0', 80), max_parallel_connections=None):
+        if max_parallel_connections is None:
+            max_parallel_connections = WebServer.connections
+
+        server_socket.setblocking (False)
+        server_socket.bind (listen_on)
+        server_socket.listen (max_parallel_connections)
+
+        clients = []
+        while True:
+            #
+            # leave new connections in the backlog while full or short of memory
+            #
+            if len (clients) < max_parallel_connections:
+                try:
+                    client, address = server_socket.accept ()
+                except OSError as e:
+                    if e.errno != errno.EAGAIN:
+                        raise
+                else:
+                    if gc.mem_free () < WebServer.reserve + WebServer.buffer:
+                        Memory.collect (force=True)
+
+                    if gc.mem_free () < WebServer.reserve + WebServer.buffer:
+                        WebServer.refused += 1
+                        client.close ()
+                    else:
+                        connection = Connection (client)
+                        clients.append ((connection, self.process_client_connection (biplane.BufferedNonBlockingSocket (connection, WebServer.buffer))))
+                        WebServer.accepted += 1
+
+            #
+            # step each connection once, dropping finished and stalled ones
+            #
+            now = ticks.ticks_ms ()
+            index = 0
+            while index < len (clients):
+                connection, processor = clients[index]
+
+                try:
+                    if connection.expired (now):
+                        WebServer.expired += 1
+                        raise StopIteration ()
+
+                    next (processor)
+                    index += 1
+                except Exception as e:
+                    connection.close ()
+                    clients.pop (index)
+
+                    #
+                    # run the cleanup of a response that was cut off
+                    #
+                    processor.close ()
+
+                    if isinstance (e, OSError) and e.errno in WebServer.disconnects:
+                        continue
+
+                    if not isinstance (e, StopIteration):
+                        exception (e)
+
+            WebServer.open = len (clients)
+            yield
+
+#
+# task to provide a web interface for status and configuration
+#
+async def web_server_task (configuration, lock, status):
+
+    WebServer.configure (configuration.get ('web', {}))
+    Events.configure (configuration.get ('events', {}))
+    server = WebServer ()
+
+    #
+    # preload the static assets
+    #
+    Asset.configure (configuration.get ('web', {}))
+    Asset.load ()
+
+    info (f'cached {Asset.cached} bytes of {len (Asset.inventory)} assets')
+
+    #
+    # supporting REST API
+    #
+    @server.route ('/api/v1/config', 'GET')
+    def handler (query_parameters, headers, body):
+        return JSONResponse (configuration)
+
+    @server.route ('/api/v1/status', 'GET')
+    def handler (query_parameters, headers, body):
+        data = status ()
+        data['web'] = WebServer.status ()
+        data['events'] = Events.status ()
+
+        return JSONResponse (data)
+
+    @server.route ('/api/v1/log', 'GET')
+    def handler (query_parameters, headers, body):
+        return JSONResponse (Log.recent ())
+
+    @server.route ('/api/v1/restart', 'GET')
+    def handler (query_parameters, headers, body):
+
+        def action ():
+            microcontroller.reset ()
+
+        return Response ('rebooting', action=action)
+
+    @server.route ('/api/v1/events', 'GET')
+    def handler (query_parameters, headers, body):
+        subscriber = Events.subscribe ()
+
+        if subscriber is None:
+            return Response ('too many subscribers', status_code=503, content_type='text/plain')
+
+        return SSEResponse (subscriber)
+
+    pool = socketpool.SocketPool (wifi.radio)
+    with pool.socket () as socket:
+        for _ in server.start (socket, listen_on=('0.0.0.0', 80)):
+            await asyncio.sleep (0)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+#
+# minify and pre-compress the web assets in a staged assets directory
+#
+# each html, css, js and svg file is rewritten minified with a gzip sibling
+# (name.gz) next to it, which the web server sends to clients that accept
+# gzip. minification is deliberately conservative: comments, indentation and
+# blank lines go, line breaks stay so that JavaScript keeps its semicolon
+# insertion.
+#
+# every asset is then listed in manifest.json under the path it is served
+# from, with its size, content type and ETag (and those of the gzip copy),
+# so that the firmware neither stats nor checksums anything at boot.
+#
+#   python3 tools/bundle.py .staging/assets
+#
+
+import gzip
+import json
+import os
+import re
+import sys
+import zlib
+
+EXTENSIONS = ('.html', '.css', '.js', '.svg')
+
+MANIFEST = 'manifest.json'
+
+CONTENT_TYPES = {
+    '.css': 'text/css',
+    '.html': 'text/html',
+    '.ico': 'image/x-icon',
+    '.js': 'text/javascript',
+    '.json': 'application/json',
+    '.png': 'image/png',
+    '.svg': 'image/svg+xml',
+    '.txt': 'text/plain'
+}
+
+def lines (text):
+    return [line.strip () for line in text.splitlines () if line.strip ()]
+
+def minify_markup (text):
+    text = re.sub (r'<!--(?!\[).*?-->', '', text, flags=re.DOTALL)
+    return '\n'.join (lines (text))
+
+def minify_css (text):
+    text = re.sub (r'/\*.*?\*/', '', text, flags=re.DOTALL)
+    return '\n'.join (lines (text))
+
+def minify_js (text):
+    return '\n'.join (line for line in lines (text) if not line.startswith ('//'))
+
+MINIFIERS = {
+    '.html': minify_markup,
+    '.svg': minify_markup,
+    '.css': minify_css,
+    '.js': minify_js
+}
+
+def bundle (directory):
+    results = []
+
+    for name in sorted (os.listdir (directory)):
+        base, extension = os.path.splitext (name)
+        if extension not in EXTENSIONS:
+            continue
+
+        path = os.path.join (directory, name)
+        with open (path, encoding='utf-8') as file:
+            original = file.read ()
+
+        data = (MINIFIERS[extension] (original) + '\n').encode ('utf-8')
+        with open (path, 'wb') as file:
+            file.write (data)
+
+        #
+        # fixed timestamp so that builds are reproducible
+        #
+        compressed = gzip.compress (data, compresslevel=9, mtime=0)
+        with open (path + '.gz', 'wb') as file:
+            file.write (compressed)
+
+        results.append ((name, len (original.encode ('utf-8')), len (data), len (compressed)))
+
+    return results
+
+def etag (data):
+    #
+    # the same form the firmware computes for assets missing from a manifest
+    #
+    return f'"{zlib.crc32 (data):08x}-{len (data):x}"'
+
+def manifest (directory):
+    entries = {}
+
+    for name in sorted (os.listdir (directory)):
+        base, extension = os.path.splitext (name)
+        if name == MANIFEST or extension == '.gz' or extension not in CONTENT_TYPES:
+            continue
+
+        path = os.path.join (directory, name)
+        with open (path, 'rb') as file:
+            data = file.read ()
+
+        entry = {
+            'file': name,
+            'type': CONTENT_TYPES[extension],
+            'size': len (data),
+            'etag': etag (data)
+        }
+
+        if os.path.exists (path + '.gz'):
+            with open (path + '.gz', 'rb') as file:
+                data = file.read ()
+
+            entry['gzip'] = {
+                'size': len (data),
+                'etag': etag (data)[:-1] + '-gz"'
+            }
+
+        entries['/' if name == 'index.html' else '/' + name] = entry
+
+    with open (os.path.join (directory, MANIFEST), 'w') as file:
+        json.dump (entries, file, indent=4, sort_keys=True)
+
+    return entries
+
+def main ():
+    if len (sys.argv) != 2:
+        print (f'usage: {sys.argv[0]} <assets directory>')
+        sys.exit (1)
+
+    total = [0, 0, 0]
+    for name, original, minified, compressed in bundle (sys.argv[1]):
+        print (f'{name:32} {original:8} {minified:8} {compressed:8}')
+        total[0] += original
+        total[1] += minified
+        total[2] += compressed
+
+    print (f'{"total":32} {total[0]:8} {total[1]:8} {total[2]:8}')
+    print (f'{len (manifest (sys.argv[1]))} assets in {MANIFEST}')
+
+if __name__ == '__main__':
+    main ()